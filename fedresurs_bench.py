@@ -0,0 +1,224 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+from fedresurs_mock import MockConfig, MockFedresurs
+from fedresurs_parser import (
+    ApiService, CrawlEngine, CrawlTask, ExcelExporter, LegalEntity, PhysicalPerson, RecordStore, log,
+)
+
+
+# =========================
+# BENCHMARK (ApiService / CrawlEngine / ExcelExporter на локальном стенде)
+# =========================
+# метрика -> True, если больше = лучше
+TRACKED = {
+    "crawl.records_per_sec": True,
+    "crawl.requests_per_record": False,
+    "crawl.latency_p95_ms": False,
+    "crawl.peak_mem_mb": False,
+    "export.append_sec": False,
+    "export.append_peak_mem_mb": False,
+    "export.report_sec": False,
+}
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    k = min(len(s) - 1, max(0, int(round(p / 100.0 * (len(s) - 1)))))
+    return s[k]
+
+
+# tracemalloc заметно замедляет openpyxl; --no-memory меряет только время
+TRACE_MEMORY = True
+
+
+def measure(fn: Callable[[], Any]) -> Tuple[Any, float, float]:
+    """
+    -> (результат, секунды, пик памяти Python в МБ)
+    """
+    if TRACE_MEMORY:
+        tracemalloc.start()
+    t0 = time.perf_counter()
+    try:
+        res = fn()
+    finally:
+        elapsed = time.perf_counter() - t0
+        peak = 0
+        if TRACE_MEMORY:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+    return res, elapsed, peak / (1024 * 1024)
+
+
+def bench_crawl(cfg: MockConfig, records: int, workers: int, page_size: int, rps: float) -> Dict[str, Any]:
+    mock = MockFedresurs(cfg).start()
+    api = ApiService(
+        host_limits={ApiService.BANKROT_HOST: workers, ApiService.FEDRESURS_HOST: workers * 2},
+        host_rates={ApiService.BANKROT_HOST: rps, ApiService.FEDRESURS_HOST: rps},
+        bankrot_base=mock.bankrot_base,
+        fedresurs_base=mock.fedresurs_base,
+    )
+
+    # задержка каждого HTTP-запроса глазами клиента
+    latencies: List[float] = []
+    raw_get = api.transport.get
+
+    def timed_get(*args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return raw_get(*args, **kwargs)
+        finally:
+            latencies.append((time.perf_counter() - t0) * 1000.0)
+
+    api.transport.get = timed_get
+    engine = CrawlEngine(api, workers=workers)
+    try:
+        res, elapsed, peak = measure(lambda: engine.run([
+            CrawlTask(True, records, page_size),
+            CrawlTask(False, records, page_size),
+        ]))
+    finally:
+        api.close()
+        mock.stop()
+
+    got = sum(len(x) for x in res.values())
+    requests_total = mock.total_requests()
+    return {
+        "records": got,
+        "seconds": round(elapsed, 3),
+        "records_per_sec": round(got / elapsed, 2) if elapsed else 0.0,
+        "requests": requests_total,
+        "requests_per_record": round(requests_total / got, 2) if got else 0.0,
+        "latency_p50_ms": round(percentile(latencies, 50), 2),
+        "latency_p95_ms": round(percentile(latencies, 95), 2),
+        "peak_mem_mb": round(peak, 2),
+        "injected_429": mock.stats.get("status:429", 0),
+        "injected_5xx": mock.stats.get("status:503", 0),
+    }
+
+
+def synthetic_records(n: int, start: int = 0) -> Tuple[List[LegalEntity], List[PhysicalPerson]]:
+    legal = [LegalEntity(fullName=f"Компания {i}", inn=str(7700000000 + i), ogrn=str(1027700000000 + i),
+                         address=f"г. Москва, ул. Ленина, д. {i % 200}", status="Конкурсное производство",
+                         caseNumber=f"А40-{i}/2024", publicationsCount=str(i % 50), tradesCount=str(i % 7),
+                         sourceUrl=f"https://fedresurs.ru/company/bench-{i}")
+             for i in range(start, start + n)]
+    phys = [PhysicalPerson(fullName=f"Иванов{i} Иван Иванович", inn=str(770000000000 + i),
+                           residenceAddress=f"г. Москва, ул. Мира, д. {i % 100}",
+                           bankruptcyStatus="Реструктуризация долгов", caseNumber=f"А40-{i}/2024",
+                           sourceUrl=f"https://fedresurs.ru/person/bench-{i}")
+            for i in range(start, start + n)]
+    return legal, phys
+
+
+def bench_export(rows: int) -> Dict[str, Any]:
+    exporter = ExcelExporter()
+    out: Dict[str, Any] = {"rows": rows}
+    with tempfile.TemporaryDirectory() as tmp:
+        file_name = os.path.join(tmp, "bench.xlsx")
+
+        legal, phys = synthetic_records(rows)
+        _, out["create_sec"], out["create_peak_mem_mb"] = measure(
+            lambda: exporter.export_resume(legal, phys, file_name))
+
+        # дописываем ещё столько же — стоимость растёт с размером файла или нет
+        legal2, phys2 = synthetic_records(rows, start=rows)
+        _, out["append_sec"], out["append_peak_mem_mb"] = measure(
+            lambda: exporter.export_resume(legal2, phys2, file_name))
+
+        store = RecordStore(os.path.join(tmp, "bench.sqlite3"))
+        try:
+            store.upsert("legal", legal + legal2)
+            store.upsert("physical", phys + phys2)
+            _, out["report_sec"], out["report_peak_mem_mb"] = measure(
+                lambda: exporter.export_report(store, os.path.join(tmp, "report.xlsx")))
+        finally:
+            store.close()
+
+    return {k: round(x, 3) if isinstance(x, float) else x for k, x in out.items()}
+
+
+def flatten(report: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    return {f"{section}.{k}": x for section, data in report.items() for k, x in data.items()}
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], max_regression: float) -> List[str]:
+    """
+    -> список регрессий больше max_regression (доля) относительно baseline
+    """
+    cur, base = flatten(current), flatten(baseline)
+    problems = []
+    for key, higher_is_better in TRACKED.items():
+        if key not in cur or not base.get(key):
+            continue
+        change = (cur[key] - base[key]) / base[key]
+        worse = -change if higher_is_better else change
+        if worse > max_regression:
+            problems.append(f"{key}: {base[key]} -> {cur[key]} ({change:+.0%})")
+    return problems
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Бенчмарк парсера на локальном стенде fedresurs_mock")
+    ap.add_argument("--records", type=int, default=200, help="записей каждого типа для сбора")
+    ap.add_argument("--workers", type=int, default=8)
+    ap.add_argument("--page-size", type=int, default=15)
+    ap.add_argument("--rps", type=float, default=1000.0, help="стартовая скорость лимитеров на стенде")
+    ap.add_argument("--latency-ms", type=float, default=MockConfig.latency_ms)
+    ap.add_argument("--jitter-ms", type=float, default=MockConfig.jitter_ms)
+    ap.add_argument("--rate-429", type=float, default=0.0)
+    ap.add_argument("--rate-5xx", type=float, default=0.0)
+    ap.add_argument("--no-biddings-found", action="store_true", help="biddings без поля found")
+    ap.add_argument("--excel-rows", type=int, default=5000, help="строк каждого типа для бенчмарка Excel (0 — пропустить)")
+    ap.add_argument("--skip-crawl", action="store_true")
+    ap.add_argument("--no-memory", action="store_true", help="не мерить память (tracemalloc искажает время)")
+    ap.add_argument("--json", dest="json_out", help="сохранить отчёт в JSON")
+    ap.add_argument("--baseline", help="сравнить с ранее сохранённым JSON-отчётом")
+    ap.add_argument("--max-regression", type=float, default=0.2, help="допустимое ухудшение (доля)")
+    args = ap.parse_args()
+
+    log.setLevel(logging.WARNING)
+    global TRACE_MEMORY
+    TRACE_MEMORY = not args.no_memory
+
+    report: Dict[str, Dict[str, Any]] = {}
+    if not args.skip_crawl:
+        cfg = MockConfig(legal_count=args.records * 2, person_count=args.records * 2,
+                         latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                         rate_429=args.rate_429, rate_5xx=args.rate_5xx,
+                         biddings_found=not args.no_biddings_found)
+        report["crawl"] = bench_crawl(cfg, args.records, args.workers, args.page_size, args.rps)
+    if args.excel_rows:
+        report["export"] = bench_export(args.excel_rows)
+
+    for section, data in report.items():
+        print(f"[{section}]")
+        for k, x in data.items():
+            print(f"  {k:<24} {x}")
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as fh:
+            problems = compare(report, json.load(fh), args.max_regression)
+        if problems:
+            print("РЕГРЕССИЯ:")
+            for p in problems:
+                print("  " + p)
+            sys.exit(1)
+        print("Регрессий нет")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+import json
+import random
+import threading
+import time
+import argparse
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+
+# =========================
+# MOCK FEDRESURS (локальный стенд вместо bankrot.fedresurs.ru / fedresurs.ru)
+# =========================
+@dataclass
+class MockConfig:
+    """
+    Синтетические данные детерминированы по seed и GUID.
+    latency_ms + jitter_ms — задержка каждого ответа;
+    rate_429 / rate_5xx — доля ответов 429 (с Retry-After) и 503.
+    epoch — «день» данных: при epoch > 0 у доли churn дел меняется статус (для проверки refresh).
+    grow_per_sec — сколько новых банкротов в секунду появляется в начале списков (сдвиг страниц).
+    down — эндпоинты, которые «лежат» (всегда 503).
+    """
+    seed: int = 42
+    legal_count: int = 5000
+    person_count: int = 5000
+    latency_ms: float = 20.0
+    jitter_ms: float = 10.0
+    rate_429: float = 0.0
+    rate_5xx: float = 0.0
+    retry_after: float = 1.0
+    max_biddings: int = 120
+    biddings_found: bool = True
+    max_page_size: int = 500
+    epoch: int = 0
+    churn: float = 0.3
+    grow_per_sec: float = 0.0
+    down: Tuple[str, ...] = ()
+
+
+REGIONS = ["г. Москва", "Московская область", "г. Санкт-Петербург", "Свердловская область", "Республика Татарстан"]
+STATUSES = [
+    ("Observation", "Наблюдение"),
+    ("CompetitiveManagement", "Конкурсное производство"),
+    ("RestructuringDebt", "Реструктуризация долгов"),
+    ("Completed", "Производство по делу завершено"),
+]
+OKVEDS = ["Торговля оптовая", "Строительство жилых и нежилых зданий", "Деятельность автомобильного грузового транспорта"]
+
+
+def guid_of(kind: str, idx: int) -> str:
+    prefix = "c" if kind == "legal" else "p"
+    return f"{prefix}{idx:07x}-0000-4000-8000-{idx:012x}"
+
+
+def index_of(guid: str) -> int:
+    return int(guid.rsplit("-", 1)[-1], 16)
+
+
+class MockData:
+    """
+    Ответы эндпоинтов; элемент с индексом 0 — самый свежий (списки отсортированы от новых к старым)
+    """
+
+    def __init__(self, cfg: MockConfig):
+        self.cfg = cfg
+        self.started = time.monotonic()
+
+    def inserted(self) -> int:
+        return int((time.monotonic() - self.started) * self.cfg.grow_per_sec)
+
+    def _id_at(self, kind: str, pos: int, inserted: int) -> int:
+        # новые записи получают индексы после исходных и встают в начало списка
+        count = self.cfg.legal_count if kind == "legal" else self.cfg.person_count
+        return count + inserted - 1 - pos if pos < inserted else pos - inserted
+
+    def _rnd(self, guid: str) -> random.Random:
+        return random.Random(f"{self.cfg.seed}:{guid}")
+
+    def _case(self, rnd: random.Random, guid: str, idx: int) -> Dict[str, Any]:
+        code, desc = rnd.choice(STATUSES)
+        if self.cfg.epoch:
+            moved = random.Random(f"{self.cfg.seed}:{guid}:epoch{self.cfg.epoch}")
+            if moved.random() < self.cfg.churn:
+                code, desc = moved.choice(STATUSES)
+        return {
+            "number": f"А40-{idx}/{rnd.randint(2015, 2025)}",
+            "arbitrManagerFio": f"Управляющий {rnd.randint(1, 300)}",
+            "status": {"code": code, "description": desc,
+                       "date": f"{rnd.randint(2016, 2025)}-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}T00:00:00"},
+        }
+
+    def list_item(self, kind: str, idx: int) -> Dict[str, Any]:
+        guid = guid_of(kind, idx)
+        rnd = self._rnd(guid)
+        item = {
+            "guid": guid,
+            "inn": f"{rnd.randint(10 ** 9, 10 ** 10 - 1) if kind == 'legal' else rnd.randint(10 ** 11, 10 ** 12 - 1)}",
+            "region": rnd.choice(REGIONS),
+            "lastLegalCase": self._case(rnd, guid, idx),
+        }
+        if kind == "legal":
+            item["name"] = f"ООО «Компания {idx}»"
+            item["ogrn"] = str(rnd.randint(10 ** 12, 10 ** 13 - 1))
+        else:
+            item["fio"] = f"Иванов{idx} Иван Иванович"
+            item["snils"] = f"{rnd.randint(100, 999)}-{rnd.randint(100, 999)}-{rnd.randint(100, 999)} {rnd.randint(10, 99)}"
+        return item
+
+    def list_page(self, kind: str, limit: int, offset: int, search: str = "") -> Dict[str, Any]:
+        inserted = self.inserted()
+        total = (self.cfg.legal_count if kind == "legal" else self.cfg.person_count) + inserted
+        limit = min(limit, self.cfg.max_page_size)
+        if search:
+            found = [item for item in (self.list_item(kind, self._id_at(kind, p, inserted)) for p in range(total))
+                     if search in (item["inn"], item["guid"])]
+            return {"pageData": found[offset:offset + limit], "total": len(found)}
+        items = [self.list_item(kind, self._id_at(kind, p, inserted))
+                 for p in range(offset, min(offset + limit, total))]
+        return {"pageData": items, "total": total}
+
+    def company(self, guid: str) -> Dict[str, Any]:
+        rnd = self._rnd(guid)
+        idx = index_of(guid)
+        return {
+            "fullName": f"ОБЩЕСТВО С ОГРАНИЧЕННОЙ ОТВЕТСТВЕННОСТЬЮ «Компания {idx}»",
+            "kpp": str(rnd.randint(10 ** 8, 10 ** 9 - 1)),
+            "addressEgrul": f"{rnd.choice(REGIONS)}, ул. Ленина, д. {rnd.randint(1, 200)}",
+            "authorizedCapital": rnd.choice([10000, 100000, 1500000]),
+            "okopf": {"name": "Общества с ограниченной ответственностью"},
+            "okved": {"name": rnd.choice(OKVEDS)},
+            "dateReg": f"{rnd.randint(1995, 2020)}-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}",
+        }
+
+    def ieb(self, guid: str) -> Dict[str, Any]:
+        rnd = self._rnd(guid + ":ieb")
+        return {"pageData": [{"inn": str(rnd.randint(10 ** 11, 10 ** 12 - 1)),
+                              "egrulDateCreate": f"{rnd.randint(2016, 2025)}-0{rnd.randint(1, 9)}-1{rnd.randint(0, 9)}"}]}
+
+    def publications(self, guid: str, limit: int) -> Dict[str, Any]:
+        found = self._rnd(guid + ":pubs").randint(0, 400)
+        return {"found": found, "pageData": [{"type": "Message"}] * min(limit, found)}
+
+    def biddings(self, guid: str, limit: int, offset: int) -> Dict[str, Any]:
+        total = self._rnd(guid + ":bids").randint(0, self.cfg.max_biddings)
+        resp: Dict[str, Any] = {"pageData": [{"lot": offset + i} for i in range(max(0, min(limit, total - offset)))]}
+        if self.cfg.biddings_found:
+            resp["found"] = total
+        return resp
+
+    def person(self, guid: str) -> Dict[str, Any]:
+        rnd = self._rnd(guid)
+        idx = index_of(guid)
+        history = [f"Петров{idx} Иван Иванович"] if rnd.random() < 0.2 else []
+        return {
+            "birthdateBankruptcy": f"{rnd.randint(1950, 2000)}-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}",
+            "birthplaceBankruptcy": f"гор. {rnd.choice(['Москва', 'Казань', 'Пермь'])}",
+            "address": f"{rnd.choice(REGIONS)}, ул. Мира, д. {rnd.randint(1, 100)}",
+            "nameHistories": history,
+        }
+
+    def entrepreneurs(self, guid: str) -> Dict[str, Any]:
+        rnd = self._rnd(guid + ":ip")
+        items = []
+        for _ in range(rnd.choice([0, 0, 1, 2])):
+            items.append({
+                "ogrnip": str(rnd.randint(10 ** 14, 10 ** 15 - 1)),
+                "dateReg": f"{rnd.randint(2000, 2020)}-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}",
+                "status": {"name": "Прекратил деятельность", "date": f"{rnd.randint(2020, 2025)}-01-15"},
+                "okved": {"name": rnd.choice(OKVEDS)},
+            })
+        return {"pageData": items}
+
+    def route(self, path: str, query: Dict[str, str]) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """
+        -> (имя эндпоинта, тело ответа или None для 404)
+        """
+        parts = [x for x in path.split("/") if x]
+        if len(parts) < 2 or parts[0] != "backend":
+            return "unknown", None
+        limit = int(query.get("limit", 15))
+        offset = int(query.get("offset", 0))
+        res = parts[1]
+
+        if res == "cmpbankrupts":
+            return res, self.list_page("legal", limit, offset, query.get("searchString", ""))
+        if res == "prsnbankrupts":
+            return res, self.list_page("physical", limit, offset, query.get("searchString", ""))
+        if res == "biddings":
+            return res, self.biddings(query.get("bankruptGuid", ""), limit, offset)
+        if res == "companies" and len(parts) >= 3:
+            guid = parts[2]
+            sub = parts[3] if len(parts) >= 4 else ""
+            if sub == "ieb":
+                return "ieb", self.ieb(guid)
+            if sub == "publications":
+                return "publications", self.publications(guid, limit)
+            return "companies", self.company(guid) if not sub else None
+        if res == "persons" and len(parts) >= 3:
+            guid = parts[2]
+            sub = parts[3] if len(parts) >= 4 else ""
+            if sub == "individual-entrepreneurs":
+                return sub, self.entrepreneurs(guid)
+            return "persons", self.person(guid) if not sub else None
+        return res, None
+
+
+class MockFedresurs:
+    """
+    Два HTTP-сервера (как два хоста): bankrot_base — списки, fedresurs_base — карточки.
+    stats — число запросов по эндпоинтам и кодам ответа.
+    """
+
+    def __init__(self, cfg: Optional[MockConfig] = None, host: str = "127.0.0.1",
+                 bankrot_port: int = 0, fedresurs_port: int = 0):
+        self.cfg = cfg or MockConfig()
+        self.data = MockData(self.cfg)
+        self.host = host
+        self._ports = (bankrot_port, fedresurs_port)
+        self._servers = []
+        self._threads = []
+        self._lock = threading.Lock()
+        self._rnd = random.Random(self.cfg.seed)
+        self.stats: Dict[str, int] = {}
+
+    @property
+    def bankrot_base(self) -> str:
+        return f"http://{self.host}:{self._servers[0].server_port}"
+
+    @property
+    def fedresurs_base(self) -> str:
+        return f"http://{self.host}:{self._servers[1].server_port}"
+
+    def start(self) -> "MockFedresurs":
+        for port in self._ports:
+            srv = ThreadingHTTPServer((self.host, port), _Handler)
+            srv.daemon_threads = True
+            srv.mock = self
+            t = threading.Thread(target=srv.serve_forever, name=f"mock-{port}", daemon=True)
+            t.start()
+            self._servers.append(srv)
+            self._threads.append(t)
+        return self
+
+    def stop(self) -> None:
+        for srv in self._servers:
+            srv.shutdown()
+            srv.server_close()
+        self._servers.clear()
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.stats = {}
+
+    def total_requests(self) -> int:
+        with self._lock:
+            return sum(n for k, n in self.stats.items() if k.startswith("endpoint:"))
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def _fault(self) -> int:
+        with self._lock:
+            r = self._rnd.random()
+        if r < self.cfg.rate_429:
+            return 429
+        if r < self.cfg.rate_429 + self.cfg.rate_5xx:
+            return 503
+        return 0
+
+    def _delay(self) -> None:
+        with self._lock:
+            jitter = self._rnd.uniform(0, self.cfg.jitter_ms)
+        time.sleep(max(0.0, self.cfg.latency_ms + jitter) / 1000.0)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        mock: MockFedresurs = self.server.mock
+        u = urlparse(self.path)
+        query = {k: vals[0] for k, vals in parse_qs(u.query).items()}
+        name, body = mock.data.route(u.path, query)
+        mock._count(f"endpoint:{name}")
+        mock._delay()
+
+        fault = 503 if name in mock.cfg.down else mock._fault()
+        if fault:
+            mock._count(f"status:{fault}")
+            headers = {"Retry-After": str(mock.cfg.retry_after)} if fault == 429 else {}
+            self._send(fault, b"", headers)
+            return
+        if body is None:
+            mock._count("status:404")
+            self._send(404, b"")
+            return
+
+        mock._count("status:200")
+        self._send(200, json.dumps(body, ensure_ascii=False).encode("utf-8"),
+                   {"Content-Type": "application/json; charset=utf-8"})
+
+    def _send(self, code: int, payload: bytes, headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(code)
+        for k, val in (headers or {}).items():
+            self.send_header(k, val)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Локальный стенд fedresurs для прогонов без живых сайтов")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--bankrot-port", type=int, default=8081)
+    ap.add_argument("--fedresurs-port", type=int, default=8082)
+    ap.add_argument("--latency-ms", type=float, default=MockConfig.latency_ms)
+    ap.add_argument("--jitter-ms", type=float, default=MockConfig.jitter_ms)
+    ap.add_argument("--rate-429", type=float, default=0.0)
+    ap.add_argument("--rate-5xx", type=float, default=0.0)
+    ap.add_argument("--records", type=int, default=MockConfig.legal_count, help="записей каждого типа")
+    ap.add_argument("--no-biddings-found", action="store_true", help="biddings без поля found")
+    ap.add_argument("--epoch", type=int, default=0, help="«день» данных: с epoch > 0 часть дел меняет статус")
+    ap.add_argument("--grow-per-sec", type=float, default=0.0,
+                    help="новых записей в секунду в начале списков (сдвиг страниц)")
+    ap.add_argument("--down", default="", help="эндпоинты через запятую, которые всегда отвечают 503")
+    args = ap.parse_args()
+
+    cfg = MockConfig(legal_count=args.records, person_count=args.records,
+                     latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                     rate_429=args.rate_429, rate_5xx=args.rate_5xx,
+                     biddings_found=not args.no_biddings_found, epoch=args.epoch,
+                     grow_per_sec=args.grow_per_sec,
+                     down=tuple(x.strip() for x in args.down.split(",") if x.strip()))
+    mock = MockFedresurs(cfg, args.host, args.bankrot_port, args.fedresurs_port).start()
+    print(f"bankrot:   {mock.bankrot_base}")
+    print(f"fedresurs: {mock.fedresurs_base}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        mock.stop()
+
+
+if __name__ == "__main__":
+    main()
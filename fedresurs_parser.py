@@ -2,16 +2,53 @@ import time
 import random
 import re
 import logging
-from dataclasses import dataclass
-from datetime import datetime
-from typing import Any, Dict, List, Optional
+import argparse
+import csv
+import json
+import gzip
+import hashlib
+import heapq
+import io
+import multiprocessing
+import queue
+import sqlite3
+import threading
+import sys
+import cProfile
+import pstats
+import tracemalloc
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from collections import OrderedDict, deque
+from dataclasses import asdict, dataclass, field
+from functools import lru_cache
+from operator import attrgetter
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import quote, urlparse
 import os
 from openpyxl import load_workbook
 import requests
+from requests.adapters import HTTPAdapter
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font
 from openpyxl.utils import get_column_letter
 
+try:
+    # необязательно: в разы быстрее разбирает ответы списков; без него — стандартный json
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    # необязательно: транспорт с HTTP/2 (--transport httpx, для HTTP/2 нужен ещё пакет h2)
+    import httpx
+except ImportError:
+    httpx = None
+
 
 # =========================
 # LOGGING
@@ -26,7 +63,11 @@ log = logging.getLogger("FedresursParser")
 # =========================
 # MODELS (1-в-1 с Java)
 # =========================
-@dataclass
+# __slots__ (Python 3.10+): записей в памяти бывают миллионы
+_SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}
+
+
+@dataclass(**_SLOTS)
 class LegalEntity:
     fullName: str = ""
     inn: str = ""
@@ -46,12 +87,12 @@ class LegalEntity:
     arbitrationManagerName: str = ""
     arbitrationManagerInn: str = ""
     managerAppointmentDate: str = ""
-    publicationsCount: str = "0"
-    tradesCount: str = "0"
+    publicationsCount: str = ""
+    tradesCount: str = ""
     sourceUrl: str = ""
 
 
-@dataclass
+@dataclass(**_SLOTS)
 class PhysicalPerson:
     fullName: str = ""
     previousFullName: str = ""
@@ -73,6 +114,51 @@ class PhysicalPerson:
     sourceUrl: str = ""
 
 
+# общая схема записи: поле -> заголовок колонки Excel; порядок колонок = порядок полей модели.
+# По ней строятся строки Excel, таблицы хранилища, CSV-выгрузка и журнал
+LEGAL_HEADERS = {
+    "fullName": "Полное наименование", "inn": "ИНН", "ogrn": "ОГРН", "kpp": "КПП",
+    "authorizedCapital": "Уставный капитал", "registrationDate": "Дата регистрации", "address": "Адрес",
+    "region": "Регион", "legalForm": "ОКОПФ", "okved": "ОКВЭД", "status": "Статус банкротства",
+    "procedureType": "Тип процедуры", "caseNumber": "№ дела", "caseStatus": "Статус дела",
+    "caseEndDate": "Дата завершения", "arbitrationManagerName": "ФИО управляющего",
+    "arbitrationManagerInn": "ИНН управляющего", "managerAppointmentDate": "Дата внесения в ЕГРЮЛ",
+    "publicationsCount": "Публикации", "tradesCount": "Торги", "sourceUrl": "URL",
+}
+
+PHYS_HEADERS = {
+    "fullName": "ФИО", "previousFullName": "Ранее имевшееся ФИО", "inn": "ИНН", "snils": "СНИЛС",
+    "birthDate": "Дата рожд.", "birthPlace": "Место рожд.", "residenceAddress": "Адрес проживания",
+    "region": "Регион", "entrepreneurOgrnip": "ОГРНИП", "entrepreneurStatus": "Статус ИП",
+    "okved": "Вид деятельности", "registrationDate": "Дата регистрации ИП",
+    "terminationDate": "Дата прекращения ИП", "bankruptcyStatus": "Статус банкротства",
+    "procedureType": "Тип процедуры", "caseNumber": "№ дела", "arbitrationManagerName": "Управляющий",
+    "sourceUrl": "URL",
+}
+
+RECORD_FIELDS: Dict[type, Tuple[str, ...]] = {
+    LegalEntity: tuple(LegalEntity.__dataclass_fields__),
+    PhysicalPerson: tuple(PhysicalPerson.__dataclass_fields__),
+}
+RECORD_HEADERS: Dict[type, List[str]] = {
+    LegalEntity: [LEGAL_HEADERS[f] for f in RECORD_FIELDS[LegalEntity]],
+    PhysicalPerson: [PHYS_HEADERS[f] for f in RECORD_FIELDS[PhysicalPerson]],
+}
+_RECORD_VALUES = {cls: attrgetter(*fields) for cls, fields in RECORD_FIELDS.items()}
+
+
+def record_values(rec) -> Tuple[str, ...]:
+    """
+    Значения записи в порядке колонок (уже нормализованы при разборе)
+    """
+    return _RECORD_VALUES[type(rec)](rec)
+
+
+def record_dict(rec) -> Dict[str, str]:
+    # asdict() копирует значения рекурсивно — для плоской записи это лишняя работа
+    return dict(zip(RECORD_FIELDS[type(rec)], record_values(rec)))
+
+
 # =========================
 # UTILS (как v() в Java + даты)
 # =========================
@@ -90,10 +176,25 @@ def v(val: Any) -> str:
     return s
 
 
+def loads_json(data: Any) -> Any:
+    """
+    Разбор JSON-ответа (bytes/str): orjson, если установлен, иначе json
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
 def format_date(date_str: Any) -> str:
     if date_str is None:
         return ""
-    s = str(date_str).strip()
+    return _format_date(str(date_str))
+
+
+@lru_cache(maxsize=16384)
+def _format_date(raw: str) -> str:
+    # дат в выдаче немного разных, а strptime дорогой — разбираем каждую строку один раз
+    s = raw.strip()
     if not s or s.lower() == "null":
         return ""
     try:
@@ -102,7 +203,7 @@ def format_date(date_str: Any) -> str:
         return dt.strftime("%d.%m.%Y")
     except Exception:
         # как в Java: если не смогли распарсить — вернём как есть
-        return s
+        return v(s)
 
 
 def jpath(obj: Any, *keys: str, default: str = "") -> str:
@@ -119,456 +220,3943 @@ def jpath(obj: Any, *keys: str, default: str = "") -> str:
     return str(cur)
 
 
-# =========================
-# API SERVICE (1-в-1 логика Java)
-# =========================
-class ApiService:
-    COMPANY_LIST_URL = "https://bankrot.fedresurs.ru/backend/cmpbankrupts"
-    PERSON_LIST_URL  = "https://bankrot.fedresurs.ru/backend/prsnbankrupts"
+def parse_retry_after(value: Any) -> Optional[float]:
+    """
+    Retry-After: либо число секунд, либо HTTP-дата
+    """
+    s = v(value)
+    if not s:
+        return None
+    try:
+        return max(0.0, float(s))
+    except ValueError:
+        pass
+    try:
+        dt = parsedate_to_datetime(s)
+    except (TypeError, ValueError):
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return max(0.0, (dt - datetime.now(timezone.utc)).total_seconds())
 
-    MAX_ATTEMPTS = 4
-    BASE_BACKOFF_MS = 700
 
-    def __init__(self):
-        self.s = requests.Session()
-        self.s.headers.update({
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
-            "Accept": "application/json, text/plain, */*",
-        })
-        self.timeout = 30
-
-    def send_get_with_retry(self, url: str, referer: str) -> Dict[str, Any]:
-        backoff = self.BASE_BACKOFF_MS / 1000.0
-        for attempt in range(1, self.MAX_ATTEMPTS + 1):
-            try:
-                r = self.s.get(url, headers={"Referer": referer}, timeout=self.timeout)
-                code = r.status_code
+def guid_from_url(url: Any) -> str:
+    """
+    https://fedresurs.ru/company/{guid} -> guid
+    """
+    u = v(url)
+    return u.rstrip("/").rsplit("/", 1)[-1] if u else ""
 
-                if code == 200:
-                    # иногда могут вернуть не-json: подстрахуемся
-                    try:
-                        return r.json()
-                    except Exception:
-                        return {}
 
-                retryable = (code == 429) or (500 <= code <= 599)
-                if not retryable:
-                    return {}
+def endpoint_name(url: str) -> str:
+    """
+    Класс эндпоинта по URL: cmpbankrupts, prsnbankrupts, companies, persons,
+    ieb, publications, individual-entrepreneurs, biddings
+    """
+    parts = [x for x in urlparse(url).path.split("/") if x]
+    if len(parts) >= 2 and parts[0] == "backend":
+        # /backend/companies/{guid}/ieb -> ieb, /backend/companies/{guid} -> companies
+        if parts[1] in ("companies", "persons") and len(parts) >= 4:
+            return parts[3]
+        return parts[1]
+    return parts[-1] if parts else ""
 
-                jitter = random.uniform(0, 0.25)
-                time.sleep(backoff + jitter)
-                backoff *= 2
-            except Exception:
-                # сетевые ошибки тоже ретраим
-                jitter = random.uniform(0, 0.25)
-                time.sleep(backoff + jitter)
-                backoff *= 2
 
-        return {}
+# =========================
+# RESPONSE CACHE (SQLite, TTL по эндпоинтам)
+# =========================
+class ResponseCache:
+    """
+    Дисковый кэш JSON-ответов по URL.
+    TTL задаётся по классу эндпоинта (endpoint_name); эндпоинты без TTL не кэшируются.
+    При превышении max_bytes вытесняются самые старые записи.
+    """
 
-    def fetch_json_with_retry(self, url: str, referer: str) -> Optional[Dict[str, Any]]:
-        node = self.send_get_with_retry(url, referer)
-        if not node:
-            return None
-        return node
+    # реестровые данные меняются редко, счётчики публикаций/торгов — часто
+    DEFAULT_TTLS = {
+        "companies": 7 * 86400,
+        "persons": 7 * 86400,
+        "ieb": 3 * 86400,
+        "individual-entrepreneurs": 3 * 86400,
+        "publications": 6 * 3600,
+        "biddings": 6 * 3600,
+    }
 
-    def fetch_list_items(self, is_legal: bool, offset: int, limit: int) -> List[Dict[str, Any]]:
-        base = self.COMPANY_LIST_URL if is_legal else self.PERSON_LIST_URL
-        url = f"{base}?limit={limit}&offset={offset}"
-        root = self.send_get_with_retry(url, "https://bankrot.fedresurs.ru/bankrupts")
+    def __init__(self, path: str, ttls: Optional[Dict[str, float]] = None, max_bytes: int = 512 * 1024 * 1024):
+        self.path = path
+        self.ttls = dict(self.DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self.max_bytes = max_bytes
 
-        page_data = root.get("pageData")
-        if isinstance(page_data, list):
-            return page_data
-        return []
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
 
-    def count_biddings(self, guid: str, referer: str) -> int:
-        total, offset, limit = 0, 0, 50
-        try:
-            while True:
-                url = (
-                    "https://fedresurs.ru/backend/biddings"
-                    f"?limit={limit}&offset={offset}&bankruptGuid={guid}"
-                )
-                resp = self.fetch_json_with_retry(url, referer)
-                if not resp:
-                    break
-                arr = resp.get("pageData")
-                if not isinstance(arr, list) or len(arr) == 0:
-                    break
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " url TEXT PRIMARY KEY, endpoint TEXT, body TEXT NOT NULL,"
+            " fetched_at REAL NOT NULL, size INTEGER NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_responses_fetched_at ON responses(fetched_at)")
+        self._size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
 
-                total += len(arr)
-                if len(arr) < limit:
-                    break
-                offset += limit
-        except Exception:
-            return 0
-        return total
+    def ttl_for(self, url: str) -> float:
+        return self.ttls.get(endpoint_name(url), 0)
 
-    def _extract_company_name(self, full_name: str) -> str:
-        if not full_name:
-            return ""
-        m = re.search(r'«(.+)»', full_name)
-        if m:
-            return m.group(1)
-        start = full_name.find('"')
-        end = full_name.rfind('"')
-        if start != -1 and end > start:
-            return full_name[start+1:end]
-        return full_name
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        ttl = self.ttl_for(url)
+        if not ttl:
+            return None
+        with self._lock:
+            row = self._db.execute("SELECT body, fetched_at FROM responses WHERE url = ?", (url,)).fetchone()
+            if row is None or time.time() - row[1] > ttl:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return loads_json(row[0])
 
-    def fetch_legal_full_details(self, list_item: Dict[str, Any]) -> LegalEntity:
-        guid = v(list_item.get("guid"))
-        e = LegalEntity()
+    def put(self, url: str, data: Dict[str, Any]) -> None:
+        if not data or not self.ttl_for(url):
+            return
+        body = json.dumps(data, ensure_ascii=False)
+        size = len(body.encode("utf-8"))
+        with self._lock:
+            old = self._db.execute("SELECT size FROM responses WHERE url = ?", (url,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (url, endpoint, body, fetched_at, size) VALUES (?, ?, ?, ?, ?)",
+                (url, endpoint_name(url), body, time.time(), size),
+            )
+            self._size += size - (old[0] if old else 0)
+            self.stores += 1
+            if self._size > self.max_bytes:
+                self._evict()
 
-        lc = list_item.get("lastLegalCase") or {}
-        e.caseNumber = v(jpath(lc, "number"))
-        e.arbitrationManagerName = v(jpath(lc, "arbitrManagerFio"))
+    def _evict(self) -> None:
+        # освобождаем с запасом 10%, чтобы не вытеснять на каждой записи
+        excess = self._size - int(self.max_bytes * 0.9)
+        doomed, freed = [], 0
+        for url, size in self._db.execute("SELECT url, size FROM responses ORDER BY fetched_at"):
+            if freed >= excess:
+                break
+            doomed.append((url,))
+            freed += size
+        self._db.executemany("DELETE FROM responses WHERE url = ?", doomed)
+        self._size -= freed
+        self.evictions += len(doomed)
 
-        status_desc = v(jpath(lc, "status", "description"))
-        status_code = v(jpath(lc, "status", "code"))
-        status_date = v(jpath(lc, "status", "date"))
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "size_bytes": self._size,
+        }
 
-        e.status = status_desc
-        e.procedureType = status_code
-        e.caseStatus = "Завершено" if "завершено" in status_desc.lower() else "Активно"
-        e.caseEndDate = format_date(status_date)
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
 
-        e.inn = v(list_item.get("inn"))
-        e.ogrn = v(list_item.get("ogrn"))
-        e.region = v(list_item.get("region"))
-        e.sourceUrl = f"https://fedresurs.ru/company/{guid}"
 
-        try:
-            details = self.fetch_json_with_retry(f"https://fedresurs.ru/backend/companies/{guid}", e.sourceUrl)
-            if details:
-                raw_name = v(details.get("fullName")) or v(list_item.get("name"))
-                e.fullName = self._extract_company_name(raw_name)
-                e.kpp = v(details.get("kpp"))
-                e.address = v(details.get("addressEgrul"))
-                e.authorizedCapital = v(details.get("authorizedCapital"))
+# =========================
+# RATE LIMITER (token bucket + AIMD)
+# =========================
+class RateLimiter:
+    """
+    Token bucket на один хост, общий для всех воркеров.
+    Скорость подстраивается по AIMD: успешный ответ — +increase rps (до max_rate),
+    429/5xx/сетевая ошибка — умножаем на decrease (не чаще раза в секунду),
+    Retry-After — пауза для всех, кто ждёт этот хост.
+    """
 
-                okopf = details.get("okopf") or {}
-                okved = details.get("okved") or {}
-                e.legalForm = v(okopf.get("name"))
-                e.okved = v(okved.get("name"))
+    def __init__(self, rate: float, max_rate: Optional[float] = None, min_rate: float = 0.2,
+                 burst: float = 1.0, increase: float = 0.1, decrease: float = 0.7):
+        self.rate = max(min_rate, rate)
+        self.max_rate = max(self.rate, max_rate or self.rate)
+        self.min_rate = min_rate
+        self.burst = max(1.0, burst)
+        self.increase = increase
+        self.decrease = decrease
 
-                e.registrationDate = format_date(details.get("dateReg"))
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
 
-            ieb = self.fetch_json_with_retry(f"https://fedresurs.ru/backend/companies/{guid}/ieb", e.sourceUrl)
-            if ieb and isinstance(ieb.get("pageData"), list) and len(ieb["pageData"]) > 0:
-                m = ieb["pageData"][0]
-                e.arbitrationManagerInn = v(m.get("inn"))
-                e.managerAppointmentDate = format_date(m.get("egrulDateCreate"))
+    def acquire(self) -> float:
+        """
+        Блокирует до получения токена, возвращает сколько секунд прождали
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                    self._last = now
+                    if self._tokens >= 1.0:
+                        self._tokens -= 1.0
+                        return waited
+                    wait = (1.0 - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
 
-            pubs = self.fetch_json_with_retry(
-                f"https://fedresurs.ru/backend/companies/{guid}/publications?limit=1",
-                e.sourceUrl
-            )
-            if pubs:
-                e.publicationsCount = str(pubs.get("found") or 0)
+    def on_success(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
 
-            e.tradesCount = str(self.count_biddings(guid, e.sourceUrl))
+    def on_throttle(self, retry_after: Optional[float] = None) -> None:
+        with self._lock:
+            now = time.monotonic()
+            # пачка 429 от параллельных воркеров — это один сигнал, а не десять
+            if now - self._last_decrease >= 1.0:
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self._last_decrease = now
+            self._tokens = 0.0
+            self._last = now
+            if retry_after:
+                self._paused_until = max(self._paused_until, now + retry_after)
 
-        except Exception as ex:
-            log.debug("Legal details failed guid=%s: %s", guid, ex)
 
-        # чистим значения как в ExcelExporter.v()
-        for field in e.__dataclass_fields__:
-            setattr(e, field, v(getattr(e, field)))
+class EndpointUnavailable(Exception):
+    """
+    Подзапрос не удался после всех попыток или отброшен разомкнутым предохранителем
+    """
 
-        return e
 
-    def fetch_physical_full_details(self, list_item: Dict[str, Any]) -> PhysicalPerson:
-        guid = v(list_item.get("guid"))
-        p = PhysicalPerson()
+class CircuitBreaker:
+    """
+    Предохранитель эндпоинта: после threshold неудачных попыток подряд размыкается
+    на cooldown секунд — запросы сразу отклоняются, не тратя попытки и паузы.
+    Затем пропускает один пробный запрос (half-open): удачный замыкает цепь,
+    неудачный снова размыкает её на вдвое больший срок (до max_cooldown),
+    неопределённый (429, прерванный) — освобождает место для следующей пробы.
+    """
 
-        # из списка
-        p.fullName = v(list_item.get("fio"))
-        p.inn = v(list_item.get("inn"))
-        p.snils = v(list_item.get("snils"))
-        p.region = v(list_item.get("region"))
-        p.sourceUrl = f"https://fedresurs.ru/person/{guid}"
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
 
-        lc = list_item.get("lastLegalCase") or {}
-        p.caseNumber = v(jpath(lc, "number"))
-        p.arbitrationManagerName = v(jpath(lc, "arbitrManagerFio"))
-        p.bankruptcyStatus = v(jpath(lc, "status", "description"))
-        p.procedureType = v(jpath(lc, "status", "code"))
+    def __init__(self, name: str, threshold: int = 5, cooldown: float = 30.0, max_cooldown: float = 600.0):
+        self.name = name
+        self.threshold = max(1, threshold)
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.state = self.CLOSED
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._cooldown = cooldown
+        self._opened_at = 0.0
+        self._probing = False
 
-        try:
-            details = self.fetch_json_with_retry(f"https://fedresurs.ru/backend/persons/{guid}", p.sourceUrl)
-            if details:
-                p.birthDate = format_date(details.get("birthdateBankruptcy"))
-                p.birthPlace = v(details.get("birthplaceBankruptcy"))
-                p.residenceAddress = v(details.get("address"))
-
-                history = details.get("nameHistories")
-                if isinstance(history, list) and len(history) > 0:
-                    p.previousFullName = ", ".join([v(x) for x in history if v(x)])
-
-            ip_json = self.fetch_json_with_retry(
-                f"https://fedresurs.ru/backend/persons/{guid}/individual-entrepreneurs?limit=50&offset=0",
-                p.sourceUrl
-            )
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self._cooldown:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probing = False
+            # half-open: пропускаем только один пробный запрос
+            if self._probing:
+                return False
+            self._probing = True
+            return True
 
-            if ip_json and isinstance(ip_json.get("pageData"), list) and len(ip_json["pageData"]) > 0:
-                best = None
-                for ip in ip_json["pageData"]:
-                    if best is None:
-                        best = ip
-                        continue
-                    d1 = v(ip.get("dateReg"))
-                    d2 = v(best.get("dateReg"))
-                    if d1 and (not d2 or d1 > d2):
-                        best = ip
+    def is_open(self) -> bool:
+        with self._lock:
+            return self.state == self.OPEN
 
-                if best:
-                    p.entrepreneurOgrnip = v(best.get("ogrnip"))
+    def on_success(self) -> None:
+        with self._lock:
+            if self.state != self.CLOSED:
+                log.warning("Эндпоинт %s снова отвечает — предохранитель замкнут", self.name)
+            self.state = self.CLOSED
+            self._failures = 0
+            self._cooldown = self.base_cooldown
+            self._probing = False
 
-                    st = best.get("status") or {}
-                    p.entrepreneurStatus = v(st.get("name"))
-                    p.terminationDate = format_date(st.get("date"))
+    def on_inconclusive(self) -> None:
+        """
+        Попытка ничего не сказала о доступности (429, прервана): проба снова разрешена
+        """
+        with self._lock:
+            self._probing = False
 
-                    ok = best.get("okved") or {}
-                    p.okved = v(ok.get("name"))
+    def on_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN:
+                self._cooldown = min(self._cooldown * 2, self.max_cooldown)
+            elif self.state == self.OPEN or self._failures < self.threshold:
+                return
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+            self._probing = False
+            log.warning("Эндпоинт %s не отвечает (%d неудач подряд) — запросы к нему отклоняются %.0f с",
+                        self.name, self._failures, self._cooldown)
 
-                    p.registrationDate = format_date(best.get("dateReg"))
 
-        except Exception as ex:
-            log.debug("Physical details failed guid=%s: %s", guid, ex)
+class PageSizer:
+    """
+    Размер страницы списка по AIMD: полная страница, отданная быстрее slow секунд и без ошибок, —
+    +step элементов (до max_size); таймаут/5xx или медленный ответ — вдвое меньше (не ниже min_size).
+    Если сервер отдал меньше запрошенного, хотя список не кончился, — это его предел: выше не растём.
+    """
 
-        # чистим значения как в ExcelExporter.v()
-        for field in p.__dataclass_fields__:
-            setattr(p, field, v(getattr(p, field)))
+    def __init__(self, start: int, max_size: int, min_size: int = 0, step: int = 0, slow: float = 2.0):
+        self.min_size = max(1, min_size or start)
+        self.max_size = max(self.min_size, max_size)
+        self.size = min(self.max_size, max(self.min_size, start))
+        self.step = max(1, step or self.min_size)
+        self.slow = slow
+        self.server_max: Optional[int] = None
+        self._lock = threading.Lock()
 
-        return p
+    def on_page(self, asked: int, got: int, seconds: float, errors: int, total: Optional[int], end: int) -> None:
+        """
+        asked/got — сколько просили и получили, errors — неудачных попыток (кроме 429),
+        total — длина списка по ответу сервера (None — не сообщает), end — смещение конца полученного
+        """
+        with self._lock:
+            if got < asked and total is not None and end < total:
+                if self.server_max is None or got < self.server_max:
+                    self.server_max = got
+                    self.max_size = max(self.min_size, got)
+                    log.info("Сервер отдаёт не больше %d элементов списка за запрос", got)
+                self.size = min(self.size, self.max_size)
+            elif errors or seconds > self.slow:
+                self.size = max(self.min_size, self.size // 2)
+            elif got == asked:
+                self.size = min(self.max_size, self.size + self.step)
+
+    def on_error(self, asked: int) -> int:
+        """
+        Запрос страницы не удался совсем -> следующий размер для повтора (asked, если уменьшать некуда)
+        """
+        with self._lock:
+            self.size = max(self.min_size, min(self.size, asked) // 2)
+            return self.size
 
 
 # =========================
-# EXCEL EXPORTER (1-в-1 заголовки + листы)
+# METRICS (счётчики по эндпоинтам, Prometheus / JSON)
 # =========================
-class ExcelExporter:
-    LEGAL_COLS = [
-        "Полное наименование", "ИНН", "ОГРН", "КПП", "Уставный капитал", "Дата регистрации",
-        "Адрес", "Регион", "ОКОПФ", "ОКВЭД", "Статус банкротства", "Тип процедуры",
-        "№ дела", "Статус дела", "Дата завершения", "ФИО управляющего",
-        "ИНН управляющего", "Дата внесения в ЕГРЮЛ", "Публикации",
-        "Торги", "URL"
-    ]
-
-    PHYS_COLS = [
-        "ФИО", "Ранее имевшееся ФИО", "ИНН", "СНИЛС", "Дата рожд.", "Место рожд.",
-        "Адрес проживания", "Регион", "ОГРНИП", "Статус ИП",
-        "Вид деятельности", "Дата регистрации ИП", "Дата прекращения ИП", "Статус банкротства",
-        "Тип процедуры", "№ дела", "Управляющий", "URL"
-    ]
+class ApiMetrics:
+    """
+    Телеметрия ApiService: по каждому эндпоинту (endpoint_name) — запросы, коды ответов,
+    ретраи, 429/5xx/таймауты/сетевые ошибки, отказы после всех попыток, байты,
+    гистограмма задержек; по типам записей — сколько собрано и темп (записей/сек).
+    """
 
-    def export_resume(self, legal_entities, physical_persons, file_name: str) -> None:
+    LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+    COUNTERS = ("requests", "retries", "throttled", "server_errors", "timeouts",
+                "network_errors", "failures", "cache_hits", "fast_fails", "bytes")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self._endpoints: Dict[str, Dict[str, Any]] = {}
+        self._records: Dict[str, int] = {}
+        self._records_started: Dict[str, float] = {}
+
+    def _ep(self, endpoint: str) -> Dict[str, Any]:
+        ep = self._endpoints.get(endpoint)
+        if ep is None:
+            ep = {c: 0 for c in self.COUNTERS}
+            ep["codes"] = {}
+            ep["buckets"] = [0] * (len(self.LATENCY_BUCKETS) + 1)
+            ep["latency_sum"] = 0.0
+            self._endpoints[endpoint] = ep
+        return ep
+
+    def observe(self, endpoint: str, status: int, seconds: float, size: int) -> None:
+        with self._lock:
+            ep = self._ep(endpoint)
+            ep["requests"] += 1
+            ep["codes"][status] = ep["codes"].get(status, 0) + 1
+            ep["bytes"] += size
+            ep["latency_sum"] += seconds
+            i = 0
+            while i < len(self.LATENCY_BUCKETS) and seconds > self.LATENCY_BUCKETS[i]:
+                i += 1
+            ep["buckets"][i] += 1
+            if status == 429:
+                ep["throttled"] += 1
+            elif 500 <= status <= 599:
+                ep["server_errors"] += 1
+
+    def inc(self, endpoint: str, counter: str, n: int = 1) -> None:
+        with self._lock:
+            self._ep(endpoint)[counter] += n
+
+    def total(self, *counters: str) -> int:
         """
-        1) Если file_name существует — ДОПИСЫВАЕМ в него
-        2) Если нет — создаём новый
-        3) Дубли отсекаем по URL (последняя колонка)
+        Сумма счётчиков по всем эндпоинтам (по умолчанию — запросы)
         """
-        if os.path.exists(file_name):
-            wb = load_workbook(file_name)
-        else:
-            wb = Workbook()
+        counters = counters or ("requests",)
+        with self._lock:
+            return sum(ep[c] for ep in self._endpoints.values() for c in counters)
 
-        # --- Legal sheet
-        if "LegalEntities" in wb.sheetnames:
-            ws_legal = wb["LegalEntities"]
-        else:
-            ws_legal = wb.active
-            ws_legal.title = "LegalEntities"
-            self._init_sheet(ws_legal, self.LEGAL_COLS)
+    def record(self, kind: str) -> None:
+        with self._lock:
+            self._records_started.setdefault(kind, time.time())
+            self._records[kind] = self._records.get(kind, 0) + 1
 
-        # --- Physical sheet
-        if "PhysicalPersons" in wb.sheetnames:
-            ws_phys = wb["PhysicalPersons"]
-        else:
-            ws_phys = wb.create_sheet("PhysicalPersons")
-            self._init_sheet(ws_phys, self.PHYS_COLS)
+    def _quantile(self, ep: Dict[str, Any], q: float) -> float:
+        total = sum(ep["buckets"])
+        if not total:
+            return 0.0
+        rank, seen, lower = q * total, 0, 0.0
+        for i, n in enumerate(ep["buckets"]):
+            upper = self.LATENCY_BUCKETS[i] if i < len(self.LATENCY_BUCKETS) else self.LATENCY_BUCKETS[-1]
+            if n and seen + n >= rank:
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+            lower = upper
+        return lower
 
-        # соберём уже существующие URL, чтобы исключать повторы
-        legal_existing = self._read_existing_urls(ws_legal, url_col_idx=len(self.LEGAL_COLS))
-        phys_existing  = self._read_existing_urls(ws_phys,  url_col_idx=len(self.PHYS_COLS))
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            endpoints = {}
+            for name, ep in sorted(self._endpoints.items()):
+                data = {c: ep[c] for c in self.COUNTERS}
+                data["codes"] = {str(k): n for k, n in sorted(ep["codes"].items())}
+                observed = sum(ep["buckets"])
+                data["latency_avg_s"] = round(ep["latency_sum"] / observed, 4) if observed else 0.0
+                data["latency_p50_s"] = round(self._quantile(ep, 0.5), 4)
+                data["latency_p95_s"] = round(self._quantile(ep, 0.95), 4)
+                endpoints[name] = data
+            records = {
+                kind: {"count": n,
+                       "per_sec": round(n / max(1e-9, now - self._records_started[kind]), 3)}
+                for kind, n in self._records.items()
+            }
+        return {"ts": round(now, 3), "uptime_s": round(now - self.started, 3),
+                "endpoints": endpoints, "records": records}
 
-        # дописываем только новые
-        added_legal = self._append_legal(ws_legal, legal_entities, legal_existing)
-        added_phys  = self._append_physical(ws_phys, physical_persons, phys_existing)
+    def to_prometheus(self) -> str:
+        counters = {
+            "requests": ("fedresurs_requests_total", "HTTP-запросы (попытки)"),
+            "retries": ("fedresurs_retries_total", "Повторные попытки"),
+            "throttled": ("fedresurs_throttled_total", "Ответы 429"),
+            "server_errors": ("fedresurs_server_errors_total", "Ответы 5xx"),
+            "timeouts": ("fedresurs_timeouts_total", "Таймауты"),
+            "network_errors": ("fedresurs_network_errors_total", "Прочие сетевые ошибки"),
+            "failures": ("fedresurs_failures_total", "Запросы без результата после всех попыток"),
+            "fast_fails": ("fedresurs_fast_fails_total", "Запросы, отклонённые предохранителем без обращения к сайту"),
+            "cache_hits": ("fedresurs_cache_hits_total", "Ответы из кэша"),
+            "bytes": ("fedresurs_response_bytes_total", "Байты тел ответов"),
+        }
+        lines = []
+        with self._lock:
+            eps = sorted(self._endpoints.items())
+            for key, (metric, help_text) in counters.items():
+                lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+                lines += [f'{metric}{{endpoint="{name}"}} {ep[key]}' for name, ep in eps]
 
-        # можно включить автоширину только по новым данным (или вообще убрать, чтобы быстрее было)
-        self._autosize(ws_legal, len(self.LEGAL_COLS))
-        self._autosize(ws_phys,  len(self.PHYS_COLS))
+            lines += ["# HELP fedresurs_responses_total Ответы по кодам",
+                      "# TYPE fedresurs_responses_total counter"]
+            for name, ep in eps:
+                lines += [f'fedresurs_responses_total{{endpoint="{name}",code="{code}"}} {n}'
+                          for code, n in sorted(ep["codes"].items())]
 
-        wb.save(file_name)
+            metric = "fedresurs_request_duration_seconds"
+            lines += [f"# HELP {metric} Длительность HTTP-запроса", f"# TYPE {metric} histogram"]
+            for name, ep in eps:
+                cumulative = 0
+                for i, n in enumerate(ep["buckets"]):
+                    cumulative += n
+                    le = str(self.LATENCY_BUCKETS[i]) if i < len(self.LATENCY_BUCKETS) else "+Inf"
+                    lines.append(f'{metric}_bucket{{endpoint="{name}",le="{le}"}} {cumulative}')
+                lines.append(f'{metric}_sum{{endpoint="{name}"}} {ep["latency_sum"]:.6f}')
+                lines.append(f'{metric}_count{{endpoint="{name}"}} {cumulative}')
 
-        log.info("Excel обновлён: %s | добавлено ЮЛ=%d, ФЛ=%d | пропущено дублей ЮЛ=%d, ФЛ=%d",
-                 file_name,
-                 added_legal, added_phys,
-                 max(0, len(legal_entities) - added_legal),
-                 max(0, len(physical_persons) - added_phys))
+            lines += ["# HELP fedresurs_records_total Собранные записи",
+                      "# TYPE fedresurs_records_total counter"]
+            lines += [f'fedresurs_records_total{{kind="{kind}"}} {n}' for kind, n in sorted(self._records.items())]
+        return "\n".join(lines) + "\n"
 
-    def _init_sheet(self, ws, cols):
-        ws.append(cols)
-        for i in range(1, len(cols) + 1):
-            ws.cell(row=1, column=i).font = Font(bold=True)
-        ws.freeze_panes = "A2"
+    def log_summary(self) -> None:
+        snap = self.snapshot()
+        log.info("Итоги по эндпоинтам (запросы | p50/p95 с | ретраи | 429 | 5xx | таймауты | отказы | "
+                 "отклонено предохранителем | кэш | МБ):")
+        for name, ep in snap["endpoints"].items():
+            log.info("  %-26s %6d | %.3f/%.3f | %d | %d | %d | %d | %d | %d | %d | %.2f",
+                     name, ep["requests"], ep["latency_p50_s"], ep["latency_p95_s"], ep["retries"],
+                     ep["throttled"], ep["server_errors"], ep["timeouts"], ep["failures"],
+                     ep["fast_fails"], ep["cache_hits"], ep["bytes"] / (1024 * 1024))
+        for kind, rec in snap["records"].items():
+            log.info("  записей %-10s %d (%.2f/сек)", kind, rec["count"], rec["per_sec"])
 
-    def _read_existing_urls(self, ws, url_col_idx: int) -> set:
-        """
-        url_col_idx: 1-based индекс колонки URL (у нас это последняя колонка)
-        """
-        urls = set()
-        # пропускаем header row (1)
-        for r in range(2, ws.max_row + 1):
-            val = ws.cell(row=r, column=url_col_idx).value
-            u = v(val)
-            if u:
-                urls.add(u)
-        return urls
 
-    def _append_legal(self, ws, entities, existing_urls: set) -> int:
-        added = 0
-        for e in entities:
-            url = v(getattr(e, "sourceUrl", ""))
-            if not url or url in existing_urls:
-                continue
+class MetricsReporter:
+    """
+    Публикация ApiMetrics: периодический JSON-снимок в файл и/или /metrics в формате Prometheus
+    """
 
-            ws.append([
-                v(e.fullName),
-                v(e.inn),
-                v(e.ogrn),
-                v(e.kpp),
-                v(e.authorizedCapital),
-                v(e.registrationDate),
-                v(e.address),
-                v(e.region),
-                v(e.legalForm),
-                v(e.okved),
-                v(e.status),
-                v(e.procedureType),
-                v(e.caseNumber),
-                v(e.caseStatus),
-                v(e.caseEndDate),
-                v(e.arbitrationManagerName),
-                v(e.arbitrationManagerInn),
-                v(e.managerAppointmentDate),
-                v(e.publicationsCount),
-                v(e.tradesCount),
-                url,
-            ])
-            existing_urls.add(url)
-            added += 1
-        return added
+    def __init__(self, metrics: ApiMetrics, json_path: str = "", interval: float = 30.0, port: int = 0,
+                 host: str = "127.0.0.1"):
+        self.metrics = metrics
+        self.json_path = json_path
+        self.interval = interval
+        self.port = port
+        self.host = host
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._server = None
 
-    def _append_physical(self, ws, persons, existing_urls: set) -> int:
-        added = 0
-        for p in persons:
-            url = v(getattr(p, "sourceUrl", ""))
-            if not url or url in existing_urls:
-                continue
+    def start(self) -> "MetricsReporter":
+        if self.json_path:
+            self._thread = threading.Thread(target=self._dump_loop, name="fedresurs-metrics", daemon=True)
+            self._thread.start()
+        if self.port:
+            self._start_http()
+        return self
 
-            ws.append([
-                v(p.fullName),
-                v(p.previousFullName),
-                v(p.inn),
-                v(p.snils),
-                v(p.birthDate),
-                v(p.birthPlace),
-                v(p.residenceAddress),
-                v(p.region),
-                v(p.entrepreneurOgrnip),
-                v(p.entrepreneurStatus),
-                v(p.okved),
-                v(p.registrationDate),
-                v(p.terminationDate),
-                v(p.bankruptcyStatus),
-                v(p.procedureType),
-                v(p.caseNumber),
-                v(p.arbitrationManagerName),
-                url,
-            ])
-            existing_urls.add(url)
-            added += 1
-        return added
+    def _dump_loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.dump()
+
+    def dump(self) -> None:
+        tmp = self.json_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(self.metrics.snapshot(), fh, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.json_path)
+
+    def _start_http(self) -> None:
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.to_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="fedresurs-metrics-http", daemon=True).start()
+        log.info("Метрики Prometheus: http://%s:%d/metrics", self.host, self.port)
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        if self.json_path:
+            self.dump()
 
-    def _autosize(self, ws, cols_count: int):
-        for col in range(1, cols_count + 1):
-            letter = get_column_letter(col)
-            max_len = 0
-            for cell in ws[letter]:
-                if cell.value is not None:
-                    max_len = max(max_len, len(str(cell.value)))
-            ws.column_dimensions[letter].width = min(max_len + 2, 60)
 
 # =========================
-# MAIN (как FedresursParserApp)
+# PROFILER (--profile: фазы прогона, категории времени, память, cProfile)
 # =========================
-def main():
-    log.info("====================================================")
-    log.info("ЗАПУСК ПРОФЕССИОНАЛЬНОГО ПАРСЕРА (ГЛУБОКИЙ СБОР)")
-    log.info("====================================================")
+class Profiler:
+    """
+    Фаза (сбор, дозаполнение, выгрузка) — стена, CPU процесса и пик памяти Python (tracemalloc).
+    Категории — секунды потоков (сумма по всем воркерам), куда ушло время внутри фаз:
+    сеть, ожидание (лимитер, слоты хоста, паузы между попытками), разбор ответов и сборка записей,
+    хранилище/журнал, выгрузка. С profile_dir каждая фаза пишет <dir>/<фаза>.pstats,
+    включая рабочие потоки (см. wrap)
+    """
 
-    TARGET_PER_TYPE = 50
-    LIMIT = 15
-    SLEEP_MS = 1500
+    CATEGORIES = {
+        "network": "сеть",
+        "wait": "ожидание",
+        "parse": "разбор",
+        "store": "хранилище",
+        "export": "выгрузка",
+    }
 
-    api = ApiService()
-    exporter = ExcelExporter()
+    def __init__(self, memory: bool = True, profile_dir: str = ""):
+        self.memory = memory
+        self.profile_dir = profile_dir
+        self.phases: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._seconds = dict.fromkeys(self.CATEGORIES, 0.0)
+        self._calls = dict.fromkeys(self.CATEGORIES, 0)
+        # профили потоков текущей фазы (None — cProfile не собирается)
+        self._profiles: Optional[List[cProfile.Profile]] = None
+        self._local = threading.local()
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
 
-    legals: List[LegalEntity] = []
-    physicals: List[PhysicalPerson] = []
+    def add(self, category: str, seconds: float) -> None:
+        with self._lock:
+            self._seconds[category] += seconds
+            self._calls[category] += 1
 
-    try:
-        log.info(">>> Фаза 1: Сбор Юридических лиц через GUID карточки...")
-        offsetL = 0
-        while len(legals) < TARGET_PER_TYPE:
-            items = api.fetch_list_items(True, offsetL, LIMIT)
-            if not items:
-                break
+    @contextmanager
+    def measure(self, category: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(category, time.perf_counter() - t0)
 
-            for item in items:
-                if len(legals) >= TARGET_PER_TYPE:
-                    break
+    @contextmanager
+    def phase(self, name: str):
+        with self._lock:
+            seconds0, calls0 = dict(self._seconds), dict(self._calls)
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            mem0 = tracemalloc.get_traced_memory()[0]
+        main = None
+        if self.profile_dir:
+            main = cProfile.Profile()
+            self._profiles = [main]
+            self._local.profiling = True
+            main.enable()
+        wall0, cpu0 = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall0, time.process_time() - cpu0
+            entry: Dict[str, Any] = {"phase": name, "wall_sec": round(wall, 3), "cpu_sec": round(cpu, 3)}
+            if main is not None:
+                main.disable()
+                self._local.profiling = False
+                profiles, self._profiles = self._profiles, None
+                path = os.path.join(self.profile_dir, f"{name}.pstats")
+                stats = pstats.Stats(*profiles)
+                stats.dump_stats(path)
+                entry["pstats"] = path
+                entry["profiles"] = len(profiles)
+            if self.memory:
+                cur, peak = tracemalloc.get_traced_memory()
+                entry["mem_peak_mb"] = round(peak / (1024 * 1024), 2)
+                entry["mem_delta_mb"] = round((cur - mem0) / (1024 * 1024), 2)
+            with self._lock:
+                entry["categories"] = {
+                    cat: {"sec": round(self._seconds[cat] - seconds0[cat], 3),
+                          "calls": self._calls[cat] - calls0[cat]}
+                    for cat in self.CATEGORIES
+                }
+            self.phases.append(entry)
 
-                le = api.fetch_legal_full_details(item)
-                legals.append(le)
+    def wrap(self, fn: Callable) -> Callable:
+        """
+        Функция для рабочего потока: пока фаза собирает cProfile, поток профилируется отдельно
+        (cProfile видит только свой поток), профиль попадает в pstats фазы
+        """
+        def run(*args, **kwargs):
+            profiles = self._profiles
+            if profiles is None or getattr(self._local, "profiling", False):
+                return fn(*args, **kwargs)
+            prof = cProfile.Profile()
+            try:
+                prof.enable()
+            except ValueError:
+                # Python 3.12+: профилировщик один на процесс и уже видит все потоки
+                return fn(*args, **kwargs)
+            self._local.profiling = True
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                prof.disable()
+                self._local.profiling = False
+                with self._lock:
+                    profiles.append(prof)
+        return run
 
-                log.info(f"[{len(legals)}/{TARGET_PER_TYPE}] ЮЛ: {le.fullName} (GUID найден)")
-                time.sleep(SLEEP_MS / 1000.0)
+    def report(self) -> None:
+        if not self.phases:
+            return
+        names = list(self.CATEGORIES.values())
+        log.info("Профиль прогона (стена | CPU | пик памяти, МБ | секунды потоков: %s):", " / ".join(names))
+        for ph in self.phases:
+            cats = ph["categories"]
+            log.info("  %-10s %8.2f с | %7.2f с | %8s | %s", ph["phase"], ph["wall_sec"], ph["cpu_sec"],
+                     ph.get("mem_peak_mb", "-"),
+                     " / ".join(f"{cats[c]['sec']:.2f}" for c in self.CATEGORIES))
+            if "pstats" in ph:
+                log.info("    cProfile (фаза + %d потоков и подзапросов): %s", ph["profiles"] - 1, ph["pstats"])
+        if self.profile_dir:
+            path = os.path.join(self.profile_dir, "profile.json")
+            with open(path, "w", encoding="utf-8") as fh:
+                json.dump(self.phases, fh, ensure_ascii=False, indent=2)
+            log.info("Профиль сохранён: %s (смотреть: python -m pstats <файл>.pstats)", path)
 
-            offsetL += LIMIT
 
-        log.info(">>> Фаза 2: Сбор Физических лиц и ИП через GUID карточки...")
-        offsetP = 0
-        while len(physicals) < TARGET_PER_TYPE:
-            items = api.fetch_list_items(False, offsetP, LIMIT)
-            if not items:
-                break
+# =========================
+# TRANSPORT (HTTP-клиент: пул соединений на хост, таймауты, HTTP/2)
+# =========================
+class HttpTransport(ABC):
+    """
+    Транспорт для ApiService: get() -> ответ с status_code, headers, content.
+    Потокобезопасен; у каждого хоста свой пул keep-alive соединений на host_limits[хост] соединений —
+    столько запросов к хосту одновременно пропускают слоты ApiService, поэтому соединения не
+    отбрасываются и не открываются заново. stats() — запросы и открытые соединения по хостам.
+    Все транспорты создаются одинаково: cls(host_limits, proxy, **options); options — настройки
+    клиента (http2, ...), незнакомые транспорту игнорируются
+    """
 
-            for item in items:
-                if len(physicals) >= TARGET_PER_TYPE:
-                    break
+    name = "base"
+    # исключения-таймауты этого клиента (ApiService считает их отдельно от сетевых ошибок)
+    TIMEOUT_ERRORS: Tuple[type, ...] = ()
+
+    HEADERS = {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
+        "Accept": "application/json, text/plain, */*",
+    }
+
+    def __init__(self, host_limits: Dict[str, int], proxy: Optional[str] = None, **options: Any):
+        self.host_limits = dict(host_limits)
+        self.proxy = proxy
+        self._lock = threading.Lock()
+        self._requests: Dict[str, int] = {}
 
-                pp = api.fetch_physical_full_details(item)
-                physicals.append(pp)
+    @abstractmethod
+    def get(self, url: str, host: str, referer: str, timeout: Tuple[float, float]) -> Any:
+        """
+        host — ключ хоста ApiService (пул), timeout — (соединение, чтение) в секундах
+        """
 
-                status_info = "+ История имен" if v(pp.previousFullName) else ""
-                log.info(f"[{len(physicals)}/{TARGET_PER_TYPE}] ФЛ: {pp.fullName} {status_info}".strip())
-                time.sleep(SLEEP_MS / 1000.0)
+    def _count(self, host: str) -> None:
+        with self._lock:
+            self._requests[host] = self._requests.get(host, 0) + 1
 
-            offsetP += LIMIT
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {host: {"requests": n} for host, n in self._requests.items()}
 
-        file_name = "fedresurs_deep_parsed.xlsx"
-        log.info(">>> Сохранение данных в Excel: %s", file_name)
-        exporter.export_resume(legals, physicals, file_name)
+    def close(self) -> None:
+        pass
 
-        log.info("ГОТОВО! Файл сохранен.")
+    def log_stats(self) -> None:
+        for host, st in sorted(self.stats().items()):
+            conns = st.get("connections")
+            reuse = f", переиспользование {1 - conns / st['requests']:.0%}" if conns and st["requests"] else ""
+            extra = "".join(f", {k} {x}" for k, x in st.items() if k not in ("requests", "connections"))
+            log.info("Соединения %s (%s): запросов %d, открыто соединений %s%s%s",
+                     host, self.name, st["requests"], "?" if conns is None else conns, reuse, extra)
 
-    except Exception as e:
-        log.exception("Критическая ошибка: %s", e)
+
+class RequestsTransport(HttpTransport):
+    """
+    requests + urllib3: отдельная сессия и пул на каждый хост, HTTP/1.1 keep-alive
+    """
+
+    name = "requests"
+    TIMEOUT_ERRORS = (requests.Timeout,)
+
+    def __init__(self, host_limits: Dict[str, int], proxy: Optional[str] = None, **options: Any):
+        super().__init__(host_limits, proxy, **options)
+        self._sessions: Dict[str, requests.Session] = {}
+
+    def _session(self, host: str) -> requests.Session:
+        session = self._sessions.get(host)
+        if session is not None:
+            return session
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                session.headers.update(self.HEADERS)
+                if self.proxy:
+                    # свой выход в сеть для воркера шардированного сбора
+                    session.proxies.update({"http": self.proxy, "https": self.proxy})
+                # пул должен вмещать все одновременные запросы к хосту, иначе urllib3 их отбрасывает
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, self.host_limits.get(host, 4)))
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._sessions[host] = session
+        return session
+
+    def get(self, url: str, host: str, referer: str, timeout: Tuple[float, float]) -> Any:
+        self._count(host)
+        return self._session(host).get(url, headers={"Referer": referer}, timeout=timeout)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        out = super().stats()
+        for host, session in list(self._sessions.items()):
+            pools = session.get_adapter("https://").poolmanager.pools
+            conns = 0
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is not None:
+                    conns += pool.num_connections
+            out.setdefault(host, {"requests": 0})["connections"] = conns
+        return out
+
+    def close(self) -> None:
+        for session in self._sessions.values():
+            session.close()
+
+
+class HttpxTransport(HttpTransport):
+    """
+    httpx: клиент на хост; с http2 — один TLS-канал на несколько одновременных запросов
+    (если сервер согласует HTTP/2), иначе HTTP/1.1 keep-alive
+    """
+
+    name = "httpx"
+
+    def __init__(self, host_limits: Dict[str, int], proxy: Optional[str] = None, http2: bool = True,
+                 **options: Any):
+        if httpx is None:
+            raise RuntimeError("для --transport httpx нужен пакет httpx (pip install httpx)")
+        super().__init__(host_limits, proxy, **options)
+        self.TIMEOUT_ERRORS = (httpx.TimeoutException,)
+        self.http2 = http2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                log.warning("Пакет h2 не установлен (pip install httpx[http2]) — httpx работает по HTTP/1.1")
+                self.http2 = False
+        self.name = "httpx/h2" if self.http2 else "httpx"
+        self._clients: Dict[str, Any] = {}
+        self._connects: Dict[str, int] = {}
+        self._versions: Dict[str, Dict[str, int]] = {}
+
+    def _client(self, host: str) -> Any:
+        client = self._clients.get(host)
+        if client is not None:
+            return client
+        with self._lock:
+            client = self._clients.get(host)
+            if client is None:
+                n = max(1, self.host_limits.get(host, 4))
+                client = httpx.Client(
+                    http2=self.http2, headers=self.HEADERS, proxy=self.proxy or None,
+                    limits=httpx.Limits(max_connections=n, max_keepalive_connections=n),
+                )
+                self._clients[host] = client
+        return client
+
+    def get(self, url: str, host: str, referer: str, timeout: Tuple[float, float]) -> Any:
+        self._count(host)
+
+        def trace(event: str, info: Dict[str, Any]) -> None:
+            # новое TCP-соединение (переиспользованные этого события не дают)
+            if event == "connection.connect_tcp.complete":
+                with self._lock:
+                    self._connects[host] = self._connects.get(host, 0) + 1
+
+        r = self._client(host).get(
+            url, headers={"Referer": referer},
+            timeout=httpx.Timeout(timeout[1], connect=timeout[0]), extensions={"trace": trace},
+        )
+        with self._lock:
+            versions = self._versions.setdefault(host, {})
+            versions[r.http_version] = versions.get(r.http_version, 0) + 1
+        return r
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        out = super().stats()
+        with self._lock:
+            for host, st in out.items():
+                st["connections"] = self._connects.get(host, 0)
+                for version, n in self._versions.get(host, {}).items():
+                    st[version] = n
+        return out
+
+    def close(self) -> None:
+        for client in self._clients.values():
+            client.close()
+
+
+TRANSPORTS = {"requests": RequestsTransport, "httpx": HttpxTransport}
+
+
+# =========================
+# API SERVICE (1-в-1 логика Java)
+# =========================
+class ApiService:
+    BANKROT_BASE = "https://bankrot.fedresurs.ru"
+    FEDRESURS_BASE = "https://fedresurs.ru"
+    BIDDINGS_PAGE = 50
+
+    BANKROT_HOST = "bankrot.fedresurs.ru"
+    FEDRESURS_HOST = "fedresurs.ru"
+
+    MAX_ATTEMPTS = 4
+    BASE_BACKOFF_MS = 700
+
+    # подзапросы карточек; biddings первым — он листает страницы в текущем потоке
+    LEGAL_ENDPOINTS = ("biddings", "companies", "ieb", "publications")
+    PHYSICAL_ENDPOINTS = ("persons", "individual-entrepreneurs")
+
+    # какие поля записи заполняет каждый подзапрос карточки (остальные — из элемента списка)
+    ENDPOINT_FIELDS = {
+        "biddings": ("tradesCount",),
+        "companies": ("kpp", "address", "authorizedCapital", "legalForm", "okved", "registrationDate"),
+        "ieb": ("arbitrationManagerInn", "managerAppointmentDate"),
+        "publications": ("publicationsCount",),
+        "persons": ("birthDate", "birthPlace", "residenceAddress", "previousFullName"),
+        "individual-entrepreneurs": ("entrepreneurOgrnip", "entrepreneurStatus", "terminationDate",
+                                     "okved", "registrationDate"),
+    }
+
+    # профили обогащения: какие подзапросы делать
+    ENRICHMENT_PROFILES = {
+        "list-only": frozenset(),
+        "core": frozenset({"companies", "persons"}),
+        "full": frozenset(LEGAL_ENDPOINTS + PHYSICAL_ENDPOINTS),
+    }
+
+    # сколько запросов одновременно держим к каждому хосту
+    DEFAULT_HOST_LIMITS = {BANKROT_HOST: 2, FEDRESURS_HOST: 6}
+    # стартовая скорость (запросов/сек); лимитер разгоняется до RATE_CEILING_FACTOR * старт
+    DEFAULT_HOST_RATES = {BANKROT_HOST: 1.0, FEDRESURS_HOST: 3.0}
+    RATE_CEILING_FACTOR = 4.0
+    # во сколько раз дольше ждать чтения ответа: страницы списков (до --max-page-size) тяжелее карточек
+    READ_TIMEOUT_FACTORS = {"cmpbankrupts": 2.0, "prsnbankrupts": 2.0}
+
+    @classmethod
+    def keep_fields(cls, kind: str, endpoints: Optional[Iterable[str]], failed: Iterable[str] = ()) -> frozenset:
+        """
+        Поля записи kind, пустые значения которых не должны затирать сохранённые: подзапросы,
+        которых нет в профиле endpoints (None — полный профиль), и не удавшиеся (failed)
+        """
+        own = cls.LEGAL_ENDPOINTS if kind == "legal" else cls.PHYSICAL_ENDPOINTS
+        skipped = {ep for ep in own if endpoints is not None and ep not in endpoints}
+        return frozenset(f for ep in skipped.union(failed) for f in cls.ENDPOINT_FIELDS[ep])
+
+    def __init__(self, host_limits: Optional[Dict[str, int]] = None,
+                 host_rates: Optional[Dict[str, float]] = None,
+                 cache: Optional[ResponseCache] = None,
+                 biddings_parallel: int = 4,
+                 bankrot_base: Optional[str] = None,
+                 fedresurs_base: Optional[str] = None,
+                 proxy: Optional[str] = None,
+                 breaker_threshold: int = 5,
+                 breaker_cooldown: float = 30.0,
+                 max_page_size: int = 0,
+                 profiler: Optional[Profiler] = None,
+                 transport: str = "requests",
+                 http2: bool = False,
+                 connect_timeout: float = 5.0,
+                 read_timeout: float = 30.0,
+                 endpoint_timeouts: Optional[Dict[str, float]] = None):
+        # (соединение, чтение) по эндпоинту; endpoint_timeouts — своё время чтения
+        self.timeouts = {"default": (connect_timeout, read_timeout)}
+        for name, factor in self.READ_TIMEOUT_FACTORS.items():
+            self.timeouts[name] = (connect_timeout, read_timeout * factor)
+        for name, seconds in (endpoint_timeouts or {}).items():
+            self.timeouts[name] = (connect_timeout, seconds)
+        self.cache = cache
+        self.metrics = ApiMetrics()
+        self.profiler = profiler
+
+        # базы можно подменить (локальный стенд fedresurs_mock.py)
+        self.bankrot_base = (bankrot_base or self.BANKROT_BASE).rstrip("/")
+        self.fedresurs_base = (fedresurs_base or self.FEDRESURS_BASE).rstrip("/")
+        self.company_list_url = f"{self.bankrot_base}/backend/cmpbankrupts"
+        self.person_list_url = f"{self.bankrot_base}/backend/prsnbankrupts"
+        self.biddings_url = f"{self.fedresurs_base}/backend/biddings"
+        self.biddings_parallel = max(1, biddings_parallel)
+        # отдаёт ли biddings общее число (None — ещё не знаем)
+        self._biddings_has_total: Optional[bool] = None
+        # адаптивный размер страниц списков (ЮЛ/ФЛ); 0 — всегда запрошенный размер
+        self.max_page_size = max_page_size
+        self._page_sizers: Dict[bool, PageSizer] = {}
+        self._page_lock = threading.Lock()
+
+        # предохранители подзапросов карточек, по эндпоинту
+        self.breakers = {
+            name: CircuitBreaker(name, breaker_threshold, breaker_cooldown)
+            for name in self.LEGAL_ENDPOINTS + self.PHYSICAL_ENDPOINTS
+        }
+
+        self.host_limits = dict(self.DEFAULT_HOST_LIMITS)
+        if host_limits:
+            self.host_limits.update(host_limits)
+        self._host_slots = {
+            host: threading.BoundedSemaphore(max(1, n)) for host, n in self.host_limits.items()
+        }
+
+        rates = dict(self.DEFAULT_HOST_RATES)
+        if host_rates:
+            rates.update(host_rates)
+        self.limiters = {
+            host: RateLimiter(rate, max_rate=rate * self.RATE_CEILING_FACTOR) for host, rate in rates.items()
+        }
+
+        # свой пул соединений на каждый хост, по его лимиту одновременных запросов
+        self.transport: HttpTransport = TRANSPORTS[transport](self.host_limits, proxy, http2=http2)
+        pool_size = max(1, sum(self.host_limits.values()))
+
+        # пул для параллельных подзапросов одной карточки (ieb, publications, ...)
+        self._pool = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="fedresurs-sub")
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=True)
+        self.transport.log_stats()
+        self.transport.close()
+        if self.cache is not None:
+            self.cache.close()
+
+    def _host_of(self, url: str) -> str:
+        """
+        Ключ хоста для лимитов: BANKROT_HOST / FEDRESURS_HOST (с учётом подменённых баз)
+        """
+        if url.startswith(self.bankrot_base + "/"):
+            return self.BANKROT_HOST
+        if url.startswith(self.fedresurs_base + "/"):
+            return self.FEDRESURS_HOST
+        return urlparse(url).hostname or ""
+
+    @contextmanager
+    def _host_slot(self, url: str):
+        """
+        Ограничивает число одновременных запросов к хосту (см. host_limits)
+        """
+        sem = self._host_slots.get(self._host_of(url))
+        if sem is None:
+            yield
+            return
+        with self._timed("wait"):
+            sem.acquire()
+        try:
+            yield
+        finally:
+            sem.release()
+
+    def _timed(self, category: str):
+        # без --profile — пустой контекст
+        return self.profiler.measure(category) if self.profiler is not None else nullcontext()
+
+    def _gather(self, *calls: Callable[[], Any]) -> List[Any]:
+        """
+        Первый вызов выполняется в текущем потоке, остальные — параллельно в пуле подзапросов.
+        В пул попадают только "листовые" запросы, поэтому взаимной блокировки нет.
+        """
+        wrap = self.profiler.wrap if self.profiler is not None else (lambda c: c)
+        futures = [self._pool.submit(wrap(c)) for c in calls[1:]]
+        first = calls[0]()
+        return [first] + [f.result() for f in futures]
+
+    def send_get_with_retry(self, url: str, referer: str, fail_fast: bool = False,
+                            trace: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        -> JSON ответа или {} при неудаче.
+        fail_fast — подзапрос карточки: учитывается предохранителем эндпоинта, при разомкнутом
+        предохранителе или после всех попыток — EndpointUnavailable вместо {}.
+        trace — сюда пишутся seconds (последняя попытка) и errors (неудачных попыток, кроме 429)
+        """
+        host = self._host_of(url)
+        limiter = self.limiters.get(host)
+        endpoint = endpoint_name(url)
+        timeout = self.timeouts.get(endpoint) or self.timeouts["default"]
+        breaker = self.breakers.get(endpoint) if fail_fast else None
+        backoff = self.BASE_BACKOFF_MS / 1000.0
+        for attempt in range(1, self.MAX_ATTEMPTS + 1):
+            if breaker is not None and not breaker.allow():
+                self.metrics.inc(endpoint, "fast_fails")
+                raise EndpointUnavailable(endpoint)
+            retry_after = None
+            try:
+                if limiter:
+                    waited = limiter.acquire()
+                    if self.profiler is not None:
+                        self.profiler.add("wait", waited)
+                with self._host_slot(url):
+                    t0 = time.perf_counter()
+                    r = self.transport.get(url, host, referer, timeout)
+                    elapsed = time.perf_counter() - t0
+                    self.metrics.observe(endpoint, r.status_code, elapsed, len(r.content))
+                if self.profiler is not None:
+                    self.profiler.add("network", elapsed)
+                if trace is not None:
+                    trace["seconds"] = elapsed
+                code = r.status_code
+
+                if code == 200:
+                    if limiter:
+                        limiter.on_success()
+                    if breaker is not None:
+                        breaker.on_success()
+                    # иногда могут вернуть не-json: подстрахуемся
+                    try:
+                        with self._timed("parse"):
+                            return loads_json(r.content)
+                    except Exception:
+                        self.metrics.inc(endpoint, "failures")
+                        return {}
+
+                retryable = (code == 429) or (500 <= code <= 599)
+                if not retryable:
+                    # эндпоинт отвечает, просто данных нет (404 и т.п.)
+                    if breaker is not None:
+                        breaker.on_success()
+                    self.metrics.inc(endpoint, "failures")
+                    return {}
+
+                retry_after = parse_retry_after(r.headers.get("Retry-After"))
+                # 429 — вопрос темпа (его решает лимитер), а не доступности эндпоинта
+                if code == 429:
+                    if breaker is not None:
+                        breaker.on_inconclusive()
+                else:
+                    if breaker is not None:
+                        breaker.on_failure()
+                    if trace is not None:
+                        trace["errors"] = trace.get("errors", 0) + 1
+            except self.transport.TIMEOUT_ERRORS:
+                self.metrics.inc(endpoint, "timeouts")
+                if breaker is not None:
+                    breaker.on_failure()
+                if trace is not None:
+                    trace["errors"] = trace.get("errors", 0) + 1
+            except Exception:
+                # сетевые ошибки тоже ретраим
+                self.metrics.inc(endpoint, "network_errors")
+                if breaker is not None:
+                    breaker.on_failure()
+                if trace is not None:
+                    trace["errors"] = trace.get("errors", 0) + 1
+            except BaseException:
+                # прерванная проба не должна навсегда занять half-open
+                if breaker is not None:
+                    breaker.on_inconclusive()
+                raise
+
+            if limiter:
+                limiter.on_throttle(retry_after)
+            if attempt == self.MAX_ATTEMPTS or (breaker is not None and breaker.is_open()):
+                break
+
+            self.metrics.inc(endpoint, "retries")
+            jitter = random.uniform(0, 0.25)
+            with self._timed("wait"):
+                time.sleep(max(backoff + jitter, retry_after or 0.0))
+            backoff *= 2
+
+        self.metrics.inc(endpoint, "failures")
+        log.debug("Не удалось получить %s после %d попыток", url, attempt)
+        if breaker is not None:
+            raise EndpointUnavailable(endpoint)
+        return {}
+
+    def fetch_json_with_retry(self, url: str, referer: str) -> Optional[Dict[str, Any]]:
+        """
+        -> JSON подзапроса карточки, None — данных нет; EndpointUnavailable — эндпоинт не ответил
+        """
+        if self.cache is not None:
+            cached = self.cache.get(url)
+            if cached:
+                self.metrics.inc(endpoint_name(url), "cache_hits")
+                return cached
+
+        node = self.send_get_with_retry(url, referer, fail_fast=True)
+        if not node:
+            return None
+
+        if self.cache is not None:
+            self.cache.put(url, node)
+        return node
+
+    def list_page_size(self, is_legal: bool, start: int) -> int:
+        """
+        Сколько элементов списка просить следующим запросом (start — исходный размер страницы)
+        """
+        if not self.max_page_size:
+            return start
+        with self._page_lock:
+            sizer = self._page_sizers.get(is_legal)
+            if sizer is None:
+                sizer = self._page_sizers[is_legal] = PageSizer(start, self.max_page_size)
+        return sizer.size
+
+    def fetch_list_items(self, is_legal: bool, offset: int, limit: int, lead: int = 0) -> List[Dict[str, Any]]:
+        """
+        Страница списка; может вернуть меньше limit, если сервер режет страницу или
+        большая страница не прошла и запрос повторён с меньшим размером.
+        lead — сколько первых элементов запрошено сверх страницы (захват для выравнивания):
+        размер страницы для PageSizer — limit - lead
+        """
+        base = self.company_list_url if is_legal else self.person_list_url
+        sizer = self._page_sizers.get(is_legal)
+        while True:
+            trace: Dict[str, Any] = {}
+            url = f"{base}?limit={limit}&offset={offset}"
+            root = self.send_get_with_retry(url, f"{self.BANKROT_BASE}/bankrupts", trace=trace)
+            page_data = root.get("pageData")
+            if isinstance(page_data, list):
+                break
+            if sizer is None or limit - lead <= sizer.min_size:
+                return []
+            # ответа нет совсем — возможно, слишком большая страница
+            smaller = sizer.on_error(limit - lead)
+            if smaller >= limit - lead:
+                return []
+            limit = smaller + lead
+
+        if sizer is not None:
+            sizer.on_page(limit - lead, max(0, len(page_data) - lead), trace.get("seconds", 0.0),
+                          trace.get("errors", 0), self._total_of(root), offset + len(page_data))
+        return page_data
+
+    def find_list_item(self, is_legal: bool, guid: str, search: str) -> Optional[Dict[str, Any]]:
+        """
+        Свежий элемент списка для известного GUID: поиск по ИНН, СНИЛС или ФИО (searchString),
+        совпадение по guid
+        """
+        if not search:
+            return None
+        base = self.company_list_url if is_legal else self.person_list_url
+        url = f"{base}?searchString={quote(search)}&limit=15&offset=0"
+        root = self.send_get_with_retry(url, f"{self.BANKROT_BASE}/bankrupts")
+        for item in root.get("pageData") or []:
+            if v(item.get("guid")) == guid:
+                return item
+        return None
+
+    def _biddings_url(self, guid: str, limit: int, offset: int) -> str:
+        return f"{self.biddings_url}?limit={limit}&offset={offset}&bankruptGuid={guid}"
+
+    @staticmethod
+    def _total_of(resp: Dict[str, Any]) -> Optional[int]:
+        for key in ("found", "total"):
+            val = resp.get(key)
+            if isinstance(val, int) and not isinstance(val, bool):
+                return val
+            if isinstance(val, str) and val.isdigit():
+                return int(val)
+        return None
+
+    def fetch_list_total(self, is_legal: bool) -> Optional[int]:
+        """
+        Сколько всего записей в списке (поле total/found), None — если сервер не сообщает
+        """
+        base = self.company_list_url if is_legal else self.person_list_url
+        root = self.send_get_with_retry(f"{base}?limit=1&offset=0", f"{self.BANKROT_BASE}/bankrupts")
+        return self._total_of(root) if root else None
+
+    def count_biddings(self, guid: str, referer: str) -> int:
+        """
+        1) limit=1 и общее число из ответа (found/total) — один запрос, как у publications
+        2) если эндпоинт его не отдаёт — постранично, см. _count_biddings_pages
+        Недоступность эндпоинта (EndpointUnavailable) не маскируется нулём.
+        """
+        try:
+            if self._biddings_has_total is not False:
+                resp = self.fetch_json_with_retry(self._biddings_url(guid, 1, 0), referer)
+                if not resp:
+                    return 0
+                total = self._total_of(resp)
+                if total is not None:
+                    self._biddings_has_total = True
+                    return total
+                arr = resp.get("pageData")
+                if not isinstance(arr, list) or len(arr) == 0:
+                    return 0
+                # общего числа нет — больше не пробуем, дальше сразу постранично
+                self._biddings_has_total = False
+            return self._count_biddings_pages(guid, referer)
+        except EndpointUnavailable:
+            raise
+        except Exception:
+            return 0
+
+    def _count_biddings_pages(self, guid: str, referer: str) -> int:
+        """
+        Первая страница — одна, дальше пачками по 2, 4, ... до biddings_parallel страниц параллельно,
+        пока не встретится неполная страница
+        """
+        limit = self.BIDDINGS_PAGE
+        total, offset, batch = 0, 0, 1
+        while True:
+            urls = [self._biddings_url(guid, limit, offset + i * limit) for i in range(batch)]
+            pages = self._gather(*[lambda u=u: self.fetch_json_with_retry(u, referer) for u in urls])
+            for resp in pages:
+                arr = resp.get("pageData") if resp else None
+                if not isinstance(arr, list) or len(arr) == 0:
+                    return total
+                total += len(arr)
+                if len(arr) < limit:
+                    return total
+            offset += batch * limit
+            batch = min(batch * 2, self.biddings_parallel)
+
+    def _extract_company_name(self, full_name: str) -> str:
+        if not full_name:
+            return ""
+        m = re.search(r'«(.+)»', full_name)
+        if m:
+            return v(m.group(1))
+        start = full_name.find('"')
+        end = full_name.rfind('"')
+        if start != -1 and end > start:
+            return v(full_name[start+1:end])
+        return full_name
+
+    def fetch_legal_full_details(self, list_item: Dict[str, Any],
+                                 endpoints: Optional[Iterable[str]] = None,
+                                 failed: Optional[List[str]] = None) -> LegalEntity:
+        """
+        endpoints — какие подзапросы карточки делать (None — все, см. ENRICHMENT_PROFILES);
+        в failed дописываются недоступные подзапросы (их поля остаются пустыми)
+        """
+        with self._timed("parse"):
+            e = self.legal_from_list(list_item)
+        missed = self.enrich_legal(e, endpoints)
+        if failed is not None:
+            failed.extend(missed)
+        return e
+
+    def legal_from_list(self, list_item: Dict[str, Any]) -> LegalEntity:
+        guid = v(list_item.get("guid"))
+        e = LegalEntity()
+
+        lc = list_item.get("lastLegalCase") or {}
+        e.caseNumber = v(jpath(lc, "number"))
+        e.arbitrationManagerName = v(jpath(lc, "arbitrManagerFio"))
+
+        status_desc = v(jpath(lc, "status", "description"))
+        status_code = v(jpath(lc, "status", "code"))
+        status_date = v(jpath(lc, "status", "date"))
+
+        e.status = status_desc
+        e.procedureType = status_code
+        e.caseStatus = "Завершено" if "завершено" in status_desc.lower() else "Активно"
+        e.caseEndDate = format_date(status_date)
+
+        e.fullName = self._extract_company_name(v(list_item.get("name")))
+        e.inn = v(list_item.get("inn"))
+        e.ogrn = v(list_item.get("ogrn"))
+        e.region = v(list_item.get("region"))
+        e.sourceUrl = f"https://fedresurs.ru/company/{guid}"
+
+        # счётчики ещё не запрашивались: пусто, а не "0"
+        e.publicationsCount = ""
+        e.tradesCount = ""
+        return e
+
+    def enrich_legal(self, e: LegalEntity, endpoints: Optional[Iterable[str]] = None) -> List[str]:
+        """
+        Дозаполняет запись из подзапросов карточки (все или только endpoints), -> недоступные
+        или не разобранные подзапросы
+        """
+        guid = guid_from_url(e.sourceUrl)
+        wanted = [ep for ep in self.LEGAL_ENDPOINTS if endpoints is None or ep in endpoints]
+        if not wanted:
+            return []
+
+        base = f"{self.fedresurs_base}/backend/companies/{guid}"
+        calls = {
+            "biddings": lambda: self.count_biddings(guid, e.sourceUrl),
+            "companies": lambda: self.fetch_json_with_retry(base, e.sourceUrl),
+            "ieb": lambda: self.fetch_json_with_retry(f"{base}/ieb", e.sourceUrl),
+            "publications": lambda: self.fetch_json_with_retry(f"{base}/publications?limit=1", e.sourceUrl),
+        }
+        failed, applied = [], []
+        try:
+            # подзапросы карточки независимы — шлём их параллельно;
+            # count_biddings идёт первым, т.к. сам листает страницы в текущем потоке
+            results = self._gather(*[self._guarded(calls[ep]) for ep in wanted])
+            for ep, (ok, res) in zip(wanted, results):
+                if ok:
+                    with self._timed("parse"):
+                        self._apply_legal(e, ep, res)
+                    applied.append(ep)
+                else:
+                    failed.append(ep)
+        except Exception as ex:
+            log.debug("Legal details failed guid=%s: %s", guid, ex)
+            # не разобранные подзапросы — тоже неудача: прежние значения сохранятся, запись дозаполнится позже
+            failed.extend(ep for ep in wanted if ep not in applied and ep not in failed)
+        # значения уже чистые: v()/format_date применяются при разборе каждого поля
+        return failed
+
+    @staticmethod
+    def _guarded(call: Callable[[], Any]) -> Callable[[], Tuple[bool, Any]]:
+        # недоступный подзапрос не должен ронять остальные подзапросы карточки
+        def run():
+            try:
+                return True, call()
+            except EndpointUnavailable:
+                return False, None
+        return run
+
+    def _apply_legal(self, e: LegalEntity, endpoint: str, res: Any) -> None:
+        if endpoint == "biddings":
+            e.tradesCount = str(res)
+
+        elif endpoint == "companies" and res:
+            raw_name = v(res.get("fullName"))
+            if raw_name:
+                e.fullName = self._extract_company_name(raw_name)
+            e.kpp = v(res.get("kpp"))
+            e.address = v(res.get("addressEgrul"))
+            e.authorizedCapital = v(res.get("authorizedCapital"))
+
+            okopf = res.get("okopf") or {}
+            okved = res.get("okved") or {}
+            e.legalForm = v(okopf.get("name"))
+            e.okved = v(okved.get("name"))
+
+            e.registrationDate = format_date(res.get("dateReg"))
+
+        elif endpoint == "ieb" and res:
+            if isinstance(res.get("pageData"), list) and len(res["pageData"]) > 0:
+                m = res["pageData"][0]
+                e.arbitrationManagerInn = v(m.get("inn"))
+                e.managerAppointmentDate = format_date(m.get("egrulDateCreate"))
+
+        elif endpoint == "publications" and res:
+            e.publicationsCount = str(res.get("found") or 0)
+
+    def fetch_physical_full_details(self, list_item: Dict[str, Any],
+                                    endpoints: Optional[Iterable[str]] = None,
+                                    failed: Optional[List[str]] = None) -> PhysicalPerson:
+        """
+        endpoints — какие подзапросы карточки делать (None — все, см. ENRICHMENT_PROFILES);
+        в failed дописываются недоступные подзапросы (их поля остаются пустыми)
+        """
+        with self._timed("parse"):
+            p = self.physical_from_list(list_item)
+        missed = self.enrich_physical(p, endpoints)
+        if failed is not None:
+            failed.extend(missed)
+        return p
+
+    def physical_from_list(self, list_item: Dict[str, Any]) -> PhysicalPerson:
+        guid = v(list_item.get("guid"))
+        p = PhysicalPerson()
+
+        # из списка
+        p.fullName = v(list_item.get("fio"))
+        p.inn = v(list_item.get("inn"))
+        p.snils = v(list_item.get("snils"))
+        p.region = v(list_item.get("region"))
+        p.sourceUrl = f"https://fedresurs.ru/person/{guid}"
+
+        lc = list_item.get("lastLegalCase") or {}
+        p.caseNumber = v(jpath(lc, "number"))
+        p.arbitrationManagerName = v(jpath(lc, "arbitrManagerFio"))
+        p.bankruptcyStatus = v(jpath(lc, "status", "description"))
+        p.procedureType = v(jpath(lc, "status", "code"))
+        return p
+
+    def enrich_physical(self, p: PhysicalPerson, endpoints: Optional[Iterable[str]] = None) -> List[str]:
+        """
+        Дозаполняет запись из подзапросов карточки (все или только endpoints), -> недоступные
+        или не разобранные подзапросы
+        """
+        guid = guid_from_url(p.sourceUrl)
+        wanted = [ep for ep in self.PHYSICAL_ENDPOINTS if endpoints is None or ep in endpoints]
+        if not wanted:
+            return []
+
+        base = f"{self.fedresurs_base}/backend/persons/{guid}"
+        calls = {
+            "persons": lambda: self.fetch_json_with_retry(base, p.sourceUrl),
+            "individual-entrepreneurs": lambda: self.fetch_json_with_retry(
+                f"{base}/individual-entrepreneurs?limit=50&offset=0", p.sourceUrl
+            ),
+        }
+        failed, applied = [], []
+        try:
+            results = self._gather(*[self._guarded(calls[ep]) for ep in wanted])
+            for ep, (ok, res) in zip(wanted, results):
+                if ok:
+                    with self._timed("parse"):
+                        self._apply_physical(p, ep, res)
+                    applied.append(ep)
+                else:
+                    failed.append(ep)
+        except Exception as ex:
+            log.debug("Physical details failed guid=%s: %s", guid, ex)
+            # не разобранные подзапросы — тоже неудача: прежние значения сохранятся, запись дозаполнится позже
+            failed.extend(ep for ep in wanted if ep not in applied and ep not in failed)
+        return failed
+
+    def _apply_physical(self, p: PhysicalPerson, endpoint: str, res: Any) -> None:
+        if endpoint == "persons" and res:
+            p.birthDate = format_date(res.get("birthdateBankruptcy"))
+            p.birthPlace = v(res.get("birthplaceBankruptcy"))
+            p.residenceAddress = v(res.get("address"))
+
+            history = res.get("nameHistories")
+            if isinstance(history, list) and len(history) > 0:
+                p.previousFullName = ", ".join([v(x) for x in history if v(x)])
+
+        elif endpoint == "individual-entrepreneurs" and res:
+            if not isinstance(res.get("pageData"), list) or len(res["pageData"]) == 0:
+                return
+            best = None
+            for ip in res["pageData"]:
+                if best is None:
+                    best = ip
+                    continue
+                d1 = v(ip.get("dateReg"))
+                d2 = v(best.get("dateReg"))
+                if d1 and (not d2 or d1 > d2):
+                    best = ip
+
+            if best:
+                p.entrepreneurOgrnip = v(best.get("ogrnip"))
+
+                st = best.get("status") or {}
+                p.entrepreneurStatus = v(st.get("name"))
+                p.terminationDate = format_date(st.get("date"))
+
+                ok = best.get("okved") or {}
+                p.okved = v(ok.get("name"))
+
+                p.registrationDate = format_date(best.get("dateReg"))
+
+
+# =========================
+# RECORD STORE (SQLite, upsert по GUID)
+# =========================
+class RecordStore:
+    """
+    Основное хранилище: по таблице на тип, ключ — GUID (из sourceUrl),
+    повторная запись того же GUID обновляет строку. Индексы по ИНН/ОГРН/СНИЛС/№ дела.
+    Excel-листы строятся из него как отчёт (ExcelExporter.export_report).
+    У строки хранится хэш содержимого: запись без изменений не переписывается,
+    а изменённые поля попадают в журнал changes (поле, было, стало, время).
+    """
+
+    TABLES = {
+        "legal": ("legal_entities", LegalEntity, ("inn", "ogrn", "caseNumber", "arbitrationManagerName")),
+        "physical": ("physical_persons", PhysicalPerson,
+                     ("inn", "snils", "caseNumber", "arbitrationManagerName", "entrepreneurOgrnip")),
+    }
+    # полнотекстовый индекс (FTS5): наименования/ФИО, включая прежние, и адреса
+    SEARCH_FIELDS = {
+        "legal": ("fullName", "address"),
+        "physical": ("fullName", "previousFullName", "residenceAddress"),
+    }
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        with self._db:
+            for table, cls, indexed in self.TABLES.values():
+                fields = list(RECORD_FIELDS[cls])
+                cols = ", ".join(f'"{f}" TEXT NOT NULL DEFAULT \'\'' for f in fields)
+                self._db.execute(
+                    f"CREATE TABLE IF NOT EXISTS {table} (guid TEXT PRIMARY KEY, {cols}, "
+                    f"content_hash TEXT NOT NULL DEFAULT '', updated_at REAL NOT NULL, "
+                    f"checked_at REAL NOT NULL DEFAULT 0)"
+                )
+                self._ensure_columns(table, fields + ["content_hash"])
+                self._ensure_columns(table, ["checked_at"], "REAL NOT NULL DEFAULT 0")
+                for f in indexed:
+                    self._db.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_{f} ON {table}("{f}")')
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS changes (id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, "
+                "guid TEXT NOT NULL, field TEXT NOT NULL, old TEXT NOT NULL, new TEXT NOT NULL, ts REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_changes_ts ON changes(ts)")
+            self.fts = self._ensure_search_index()
+            # очередь отложенного обогащения: какие подзапросы карточки ещё сделать
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS backfill (id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, "
+                "guid TEXT NOT NULL, endpoints TEXT NOT NULL, queued_at REAL NOT NULL, UNIQUE(kind, guid))"
+            )
+
+    def _ensure_search_index(self) -> bool:
+        """
+        FTS5-таблица <table>_fts поверх основной (external content) и триггеры,
+        которые держат её в актуальном состоянии при каждой записи. -> False, если в SQLite нет FTS5
+        """
+        for kind, (table, _, _) in self.TABLES.items():
+            fts = f"{table}_fts"
+            cols = self.SEARCH_FIELDS[kind]
+            names = ", ".join(f'"{f}"' for f in cols)
+            new_vals = ", ".join(f'new."{f}"' for f in cols)
+            old_vals = ", ".join(f'old."{f}"' for f in cols)
+            exists = self._db.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (fts,)).fetchone()
+            try:
+                self._db.execute(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({names}, content='{table}', "
+                    f"content_rowid='rowid', tokenize='unicode61 remove_diacritics 2')"
+                )
+            except sqlite3.OperationalError as ex:
+                log.debug("FTS5 недоступен (%s) — полнотекстовый поиск отключён", ex)
+                return False
+            self._db.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+                f"INSERT INTO {fts}(rowid, {names}) VALUES (new.rowid, {new_vals}); END"
+            )
+            self._db.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+                f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.rowid, {old_vals}); END"
+            )
+            self._db.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {names} ON {table} BEGIN "
+                f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.rowid, {old_vals}); "
+                f"INSERT INTO {fts}(rowid, {names}) VALUES (new.rowid, {new_vals}); END"
+            )
+            if not exists:
+                # индекс появился у уже наполненной базы — строим по имеющимся строкам
+                self._db.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+        return True
+
+    def rebuild_search_index(self) -> None:
+        if not self.fts:
+            return
+        with self._lock, self._db:
+            for table, _, _ in self.TABLES.values():
+                self._db.execute(f"INSERT INTO {table}_fts({table}_fts) VALUES ('rebuild')")
+
+    def search(self, kind: str, text: str, limit: int = 20) -> list:
+        """
+        Полнотекстовый поиск по SEARCH_FIELDS: все слова запроса (как префиксы), по релевантности
+        """
+        table, cls, _ = self.TABLES[kind]
+        words = re.findall(r"\w+", text)
+        if not self.fts or not words:
+            return []
+        match = " ".join('"{}"*'.format(w.replace('"', "")) for w in words)
+        cols = ", ".join(f't."{f}"' for f in self._fields(kind))
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {cols} FROM {table}_fts f JOIN {table} t ON t.rowid = f.rowid "
+                f"WHERE {table}_fts MATCH ? ORDER BY f.rank LIMIT ?", (match, limit)
+            ).fetchall()
+        return [cls(*row) for row in rows]
+
+    def _ensure_columns(self, table: str, fields: List[str], decl: str = "TEXT NOT NULL DEFAULT ''") -> None:
+        # база от старой версии парсера — досоздаём недостающие колонки
+        have = {row[1] for row in self._db.execute(f"PRAGMA table_info({table})")}
+        for f in fields:
+            if f not in have:
+                self._db.execute(f'ALTER TABLE {table} ADD COLUMN "{f}" {decl}')
+
+    @staticmethod
+    def kind_of(rec) -> str:
+        return "legal" if isinstance(rec, LegalEntity) else "physical"
+
+    def _fields(self, kind: str) -> List[str]:
+        return list(RECORD_FIELDS[self.TABLES[kind][1]])
+
+    @staticmethod
+    def content_hash(values: List[str]) -> str:
+        return hashlib.sha1("\x1f".join(values).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def is_active(rec) -> bool:
+        """
+        Дело ещё идёт (статус может измениться)
+        """
+        if isinstance(rec, LegalEntity):
+            return rec.caseStatus != "Завершено"
+        return "завершено" not in rec.bankruptcyStatus.lower()
+
+    def _current(self, table: str, fields: List[str], guids: List[str]) -> Dict[str, Tuple[str, List[str]]]:
+        # guid -> (хэш, значения) уже сохранённых строк; IN (...) порциями из-за лимита параметров SQLite
+        cols = ", ".join(f'"{f}"' for f in fields)
+        out = {}
+        for i in range(0, len(guids), 500):
+            part = guids[i:i + 500]
+            marks = ", ".join("?" * len(part))
+            for row in self._db.execute(
+                f"SELECT guid, content_hash, {cols} FROM {table} WHERE guid IN ({marks})", part
+            ):
+                out[row[0]] = (row[1], list(row[2:]))
+        return out
+
+    def upsert(self, kind: str, records: Iterable, keep_fields: Iterable[str] = ()) -> int:
+        """
+        Пишет записи по GUID, -> сколько строк добавлено или изменено.
+        Строки с тем же хэшем содержимого не переписываются (обновляется только checked_at —
+        время последней проверки); у изменённых разница пишется в changes.
+        keep_fields — поля, пустые значения которых не затирают уже сохранённые
+        (их подзапрос не делался по профилю обогащения или не удался); остальные пишутся как есть
+        """
+        table = self.TABLES[kind][0]
+        fields = self._fields(kind)
+        keep = [f in set(keep_fields) for f in fields]
+        incoming: Dict[str, List[str]] = {}
+        for rec in records:
+            guid = guid_from_url(rec.sourceUrl)
+            if guid:
+                incoming[guid] = list(record_values(rec))
+        if not incoming:
+            return 0
+
+        cols = ", ".join(f'"{f}"' for f in fields)
+        marks = ", ".join("?" * (len(fields) + 4))
+        updates = ", ".join(f'"{f}" = excluded."{f}"' for f in fields)
+        sql = (
+            f"INSERT INTO {table} (guid, {cols}, content_hash, updated_at, checked_at) VALUES ({marks}) "
+            f"ON CONFLICT(guid) DO UPDATE SET {updates}, content_hash = excluded.content_hash, "
+            f"updated_at = excluded.updated_at, checked_at = excluded.checked_at"
+        )
+        now = time.time()
+        with self._lock, self._db:
+            current = self._current(table, fields, list(incoming))
+            rows, changes, unchanged = [], [], []
+            for guid, values in incoming.items():
+                prev = current.get(guid)
+                if prev is not None and any(keep):
+                    values = [old if k and new == "" else new for new, old, k in zip(values, prev[1], keep)]
+                digest = self.content_hash(values)
+                if prev is not None:
+                    if digest == prev[0]:
+                        unchanged.append((now, guid))
+                        continue
+                    changes.extend((kind, guid, f, old, new, now)
+                                   for f, old, new in zip(fields, prev[1], values) if old != new)
+                rows.append((guid, *values, digest, now, now))
+            if rows:
+                self._db.executemany(sql, rows)
+            if unchanged:
+                self._db.executemany(f"UPDATE {table} SET checked_at = ? WHERE guid = ?", unchanged)
+            if changes:
+                self._db.executemany(
+                    "INSERT INTO changes (kind, guid, field, old, new, ts) VALUES (?, ?, ?, ?, ?, ?)", changes
+                )
+        return len(rows)
+
+    def iter_refresh_state(self, kind: str) -> Iterator[Tuple[str, str, bool, float]]:
+        """
+        -> (guid, ИНН, дело активно, время последней проверки) для планировщика обновлений
+        """
+        table, cls, _ = self.TABLES[kind]
+        status = "caseStatus" if kind == "legal" else "bankruptcyStatus"
+        cur = self._db.cursor()
+        for guid, inn, st, checked_at in cur.execute(f'SELECT guid, inn, "{status}", checked_at FROM {table}'):
+            yield guid, inn, self.is_active(cls(**{status: st})), checked_at
+
+    def iter_changes(self, since: float = 0.0) -> Iterator[Tuple[float, str, str, str, str, str]]:
+        """
+        -> (ts, kind, guid, field, old, new) в порядке появления
+        """
+        cur = self._db.cursor()
+        yield from cur.execute(
+            "SELECT ts, kind, guid, field, old, new FROM changes WHERE ts >= ? ORDER BY id", (since,)
+        )
+
+    def known_guids(self, kind: str) -> set:
+        table = self.TABLES[kind][0]
+        with self._lock:
+            return {row[0] for row in self._db.execute(f"SELECT guid FROM {table}")}
+
+    def count(self, kind: str) -> int:
+        table = self.TABLES[kind][0]
+        with self._lock:
+            return self._db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def iter_records(self, kind: str) -> Iterator:
+        table, cls, _ = self.TABLES[kind]
+        cols = ", ".join(f'"{f}"' for f in self._fields(kind))
+        # отдельный курсор: строки читаются лениво, в памяти не копятся
+        cur = self._db.cursor()
+        for row in cur.execute(f"SELECT {cols} FROM {table} ORDER BY rowid"):
+            yield cls(*row)
+
+    def find(self, kind: str, field: str, value: str, limit: int = 0) -> list:
+        """
+        Точный поиск по полю (по индексированным — через индекс); limit=0 — без ограничения
+        """
+        table, cls, _ = self.TABLES[kind]
+        fields = self._fields(kind)
+        if field not in fields and field != "guid":
+            raise ValueError(f"Неизвестное поле {field}")
+        cols = ", ".join(f'"{f}"' for f in fields)
+        with self._lock:
+            rows = self._db.execute(
+                f'SELECT {cols} FROM {table} WHERE "{field}" = ? LIMIT ?', (value, limit or -1)
+            ).fetchall()
+        return [cls(*row) for row in rows]
+
+    def get(self, kind: str, guid: str):
+        found = self.find(kind, "guid", guid)
+        return found[0] if found else None
+
+    def queue_backfill(self, kind: str, guids: Iterable[str], endpoints: Iterable[str], delay: float = 0.0) -> int:
+        """
+        Ставит GUID в очередь дозаполнения (повторная постановка заменяет набор подзапросов).
+        delay — не брать раньше чем через столько секунд (эндпоинт сейчас недоступен)
+        """
+        eps = ",".join(sorted(endpoints))
+        ready_at = time.time() + delay
+        rows = [(kind, g, eps, ready_at) for g in guids if g]
+        if not rows or not eps:
+            return 0
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT INTO backfill (kind, guid, endpoints, queued_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(kind, guid) DO UPDATE SET endpoints = excluded.endpoints, queued_at = excluded.queued_at",
+                rows,
+            )
+        return len(rows)
+
+    def next_backfill(self, after_id: int = 0, limit: int = 100) -> List[Tuple[int, str, str, Tuple[str, ...]]]:
+        """
+        -> [(id, kind, guid, endpoints)] в порядке постановки, начиная после after_id
+        (отложенные на потом — queued_at в будущем — пропускаются)
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, kind, guid, endpoints FROM backfill WHERE id > ? AND queued_at <= ? ORDER BY id LIMIT ?",
+                (after_id, time.time(), limit),
+            ).fetchall()
+        return [(i, kind, guid, tuple(eps.split(","))) for i, kind, guid, eps in rows]
+
+    def complete_backfill(self, ids: Iterable[int]) -> None:
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM backfill WHERE id = ?", [(i,) for i in ids])
+
+    def backfill_count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM backfill").fetchone()[0]
+
+    def _stamps(self, table: str, guids: List[str]) -> Dict[str, float]:
+        # guid -> updated_at уже сохранённых строк
+        out = {}
+        for i in range(0, len(guids), 500):
+            part = guids[i:i + 500]
+            marks = ", ".join("?" * len(part))
+            out.update(self._db.execute(f"SELECT guid, updated_at FROM {table} WHERE guid IN ({marks})", part))
+        return out
+
+    def merge_from(self, path: str, endpoints: Optional[Iterable[str]] = None) -> Dict[str, int]:
+        """
+        Вливает записи другой базы (шарда) через upsert: дедупликация по GUID, хэш и журнал changes —
+        как при сборе; строки шарда старше уже сохранённых пропускаются. endpoints — профиль
+        обогащения шардов (None — полный): поля не запрошенных подзапросов и подзапросов, ждущих
+        в очереди дозаполнения шарда, не затирают сохранённые. -> добавлено/изменено по kind;
+        очередь шарда переносится тоже -> merged["backfill"]
+        """
+        shard = sqlite3.connect(path)
+        try:
+            tables = {row[0] for row in shard.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            queue_rows = []
+            if "backfill" in tables:
+                queue_rows = shard.execute("SELECT kind, guid, endpoints, queued_at FROM backfill").fetchall()
+            failed = {(kind, guid): eps.split(",") for kind, guid, eps, _ in queue_rows}
+
+            merged = {}
+            for kind, (table, cls, _) in self.TABLES.items():
+                merged[kind] = 0
+                if table not in tables:
+                    continue
+                have = {row[1] for row in shard.execute(f"PRAGMA table_info({table})")}
+                fields = [f for f in RECORD_FIELDS[cls] if f in have]
+                cols = ", ".join(f'"{f}"' for f in fields)
+                cur = shard.execute(f"SELECT guid, updated_at, {cols} FROM {table}")
+                while True:
+                    rows = cur.fetchmany(500)
+                    if not rows:
+                        break
+                    with self._lock:
+                        stored = self._stamps(table, [row[0] for row in rows])
+                    groups: Dict[frozenset, list] = {}
+                    for guid, updated_at, *values in rows:
+                        if stored.get(guid, 0) > updated_at:
+                            continue
+                        keep = ApiService.keep_fields(kind, endpoints, failed.get((kind, guid), ()))
+                        groups.setdefault(keep, []).append(cls(**dict(zip(fields, values))))
+                    for keep, records in groups.items():
+                        merged[kind] += self.upsert(kind, records, keep_fields=keep)
+
+            if queue_rows:
+                with self._lock, self._db:
+                    self._db.executemany(
+                        "INSERT INTO backfill (kind, guid, endpoints, queued_at) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT(kind, guid) DO UPDATE SET endpoints = excluded.endpoints, "
+                        "queued_at = excluded.queued_at",
+                        queue_rows,
+                    )
+            merged["backfill"] = len(queue_rows)
+        finally:
+            shard.close()
+        return merged
+
+    def last_updated(self) -> float:
+        """
+        Время последнего добавления или изменения записи (0 — хранилище пусто)
+        """
+        with self._lock:
+            return max(self._db.execute(f"SELECT COALESCE(MAX(updated_at), 0) FROM {table}").fetchone()[0]
+                       for table, _, _ in self.TABLES.values())
+
+    def max_lengths(self, kind: str) -> List[int]:
+        table = self.TABLES[kind][0]
+        expr = ", ".join(f'COALESCE(MAX(LENGTH("{f}")), 0)' for f in self._fields(kind))
+        with self._lock:
+            return list(self._db.execute(f"SELECT {expr} FROM {table}").fetchone())
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+# =========================
+# EXCEL EXPORTER (1-в-1 заголовки + листы)
+# =========================
+class ExcelExporter:
+    LEGAL_COLS = RECORD_HEADERS[LegalEntity]
+    PHYS_COLS = RECORD_HEADERS[PhysicalPerson]
+
+    INDEX_SUFFIX = ".index.json"
+    MAX_COL_WIDTH = 60
+
+    def export_resume(self, legal_entities, physical_persons, file_name: str) -> None:
+        """
+        1) Если file_name существует — ДОПИСЫВАЕМ в него
+        2) Если нет — создаём новый
+        3) Дубли отсекаем по URL (последняя колонка)
+
+        Дедупликация и ширины колонок берутся из индекса-спутника <file>.index.json,
+        поэтому книгу для этого не открываем. Запись потоковая: старые строки копируются
+        из read-only книги в write-only, память не зависит от размера файла.
+        Если новых записей нет — файл не переписывается.
+        """
+        index = self._load_index(file_name)
+
+        new_legal = self._collect_new(legal_entities, index["LegalEntities"])
+        new_phys = self._collect_new(physical_persons, index["PhysicalPersons"])
+
+        if new_legal or new_phys or not os.path.exists(file_name):
+            self._write_streaming(file_name, index, {"LegalEntities": new_legal, "PhysicalPersons": new_phys})
+            self._save_index(file_name, index)
+
+        added_legal, added_phys = len(new_legal), len(new_phys)
+        log.info("Excel обновлён: %s | добавлено ЮЛ=%d, ФЛ=%d | пропущено дублей ЮЛ=%d, ФЛ=%d",
+                 file_name,
+                 added_legal, added_phys,
+                 max(0, len(legal_entities) - added_legal),
+                 max(0, len(physical_persons) - added_phys))
+
+    def export_report(self, store: RecordStore, file_name: str) -> None:
+        """
+        Полностью перестраивает книгу из хранилища (потоково, write-only)
+        """
+        index = self._empty_index()
+        sheets = (("LegalEntities", "legal"), ("PhysicalPersons", "physical"))
+        cols_by_sheet = dict(self._sheets())
+
+        wb = Workbook(write_only=True)
+        for sheet, kind in sheets:
+            ws = wb.create_sheet(sheet)
+            widths = index[sheet]["widths"]
+            for i, n in enumerate(store.max_lengths(kind)):
+                widths[i] = max(widths[i], n)
+                ws.column_dimensions[get_column_letter(i + 1)].width = min(widths[i] + 2, self.MAX_COL_WIDTH)
+            self._init_sheet(ws, cols_by_sheet[sheet])
+
+            urls = index[sheet]["urls"]
+            for rec in store.iter_records(kind):
+                row = self._row(rec)
+                ws.append(row)
+                urls.add(row[-1])
+
+        tmp = file_name + ".tmp"
+        wb.save(tmp)
+        os.replace(tmp, file_name)
+        self._save_index(file_name, index)
+
+        log.info("Отчёт Excel перестроен из хранилища: %s | ЮЛ=%d, ФЛ=%d",
+                 file_name, len(index["LegalEntities"]["urls"]), len(index["PhysicalPersons"]["urls"]))
+
+    def refresh_report(self, store: RecordStore, file_name: str) -> bool:
+        """
+        Перестраивает отчёт, только если хранилище менялось после его построения, -> перестроен ли
+        """
+        if os.path.exists(file_name) and store.last_updated() <= os.path.getmtime(file_name):
+            log.info("Хранилище не менялось после построения %s — отчёт не перестраивается", file_name)
+            return False
+        self.export_report(store, file_name)
+        return True
+
+    def iter_workbook_records(self, file_name: str) -> Iterator[Tuple[str, Any]]:
+        """
+        Записи из существующей книги -> (kind, LegalEntity | PhysicalPerson); для переноса в хранилище
+        """
+        wb = load_workbook(file_name, read_only=True)
+        try:
+            for sheet, cols in self._sheets():
+                if sheet not in wb.sheetnames:
+                    continue
+                kind, cls = ("legal", LegalEntity) if sheet == "LegalEntities" else ("physical", PhysicalPerson)
+                for row in wb[sheet].iter_rows(min_row=2, max_col=len(cols), values_only=True):
+                    values = [v(x) for x in row] + [""] * (len(cols) - len(row))
+                    if values[-1]:
+                        yield kind, cls(*values)
+        finally:
+            wb.close()
+
+    def read_known_guids(self, file_name: str):
+        """
+        GUID уже выгруженных записей (из колонки URL) -> (legal_guids, physical_guids)
+        """
+        index = self._load_index(file_name)
+        legal = {guid_from_url(u) for u in index["LegalEntities"]["urls"]}
+        phys = {guid_from_url(u) for u in index["PhysicalPersons"]["urls"]}
+        return legal, phys
+
+    # --- индекс-спутник: URL для дедупликации + максимальная длина значения по колонкам
+
+    def _sheets(self):
+        return (("LegalEntities", self.LEGAL_COLS), ("PhysicalPersons", self.PHYS_COLS))
+
+    def _empty_index(self) -> Dict[str, Dict[str, Any]]:
+        return {sheet: {"urls": set(), "widths": [len(c) for c in cols]} for sheet, cols in self._sheets()}
+
+    def _workbook_stamp(self, file_name: str) -> Optional[List[int]]:
+        if not os.path.exists(file_name):
+            return None
+        st = os.stat(file_name)
+        return [st.st_mtime_ns, st.st_size]
+
+    def _load_index(self, file_name: str) -> Dict[str, Dict[str, Any]]:
+        stamp = self._workbook_stamp(file_name)
+        if stamp is None:
+            return self._empty_index()
+
+        try:
+            with open(file_name + self.INDEX_SUFFIX, encoding="utf-8") as fh:
+                raw = json.load(fh)
+            if raw.get("workbook") == stamp:
+                index = self._empty_index()
+                for sheet, data in raw["sheets"].items():
+                    if sheet in index:
+                        index[sheet]["urls"] = set(data["urls"])
+                        index[sheet]["widths"] = list(data["widths"])
+                return index
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+        # индекса нет или книгу меняли руками — один раз пересобираем по самой книге
+        log.info("Индекс %s отсутствует или устарел — пересобираем по книге", file_name + self.INDEX_SUFFIX)
+        return self._scan_workbook(file_name)
+
+    def _scan_workbook(self, file_name: str) -> Dict[str, Dict[str, Any]]:
+        index = self._empty_index()
+        wb = load_workbook(file_name, read_only=True)
+        try:
+            for sheet, cols in self._sheets():
+                if sheet not in wb.sheetnames:
+                    continue
+                idx = index[sheet]
+                for row in wb[sheet].iter_rows(min_row=2, max_col=len(cols), values_only=True):
+                    u = v(row[-1]) if len(row) == len(cols) else ""
+                    if u:
+                        idx["urls"].add(u)
+                    self._track_widths(idx["widths"], row)
+        finally:
+            wb.close()
+        return index
+
+    def _save_index(self, file_name: str, index: Dict[str, Dict[str, Any]]) -> None:
+        raw = {
+            "workbook": self._workbook_stamp(file_name),
+            "sheets": {
+                sheet: {"urls": sorted(data["urls"]), "widths": data["widths"]}
+                for sheet, data in index.items()
+            },
+        }
+        tmp = file_name + self.INDEX_SUFFIX + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(raw, fh, ensure_ascii=False)
+        os.replace(tmp, file_name + self.INDEX_SUFFIX)
+
+    @staticmethod
+    def _track_widths(widths: List[int], row) -> None:
+        for i, val in enumerate(row):
+            if val is not None:
+                n = len(str(val))
+                if n > widths[i]:
+                    widths[i] = n
+
+    # --- строки
+
+    def _collect_new(self, records, sheet_index: Dict[str, Any]) -> List[list]:
+        rows = []
+        existing_urls = sheet_index["urls"]
+        for rec in records:
+            url = rec.sourceUrl
+            if not url or url in existing_urls:
+                continue
+            row = self._row(rec)
+            rows.append(row)
+            existing_urls.add(url)
+            self._track_widths(sheet_index["widths"], row)
+        return rows
+
+    @staticmethod
+    def _row(rec) -> list:
+        # колонки — RECORD_FIELDS типа записи; значения уже нормализованы
+        # (при разборе ответа, в хранилище, при переносе из книги)
+        return list(record_values(rec))
+
+    # --- потоковая запись
+
+    def _write_streaming(self, file_name: str, index: Dict[str, Dict[str, Any]],
+                         new_rows: Dict[str, List[list]]) -> None:
+        src = load_workbook(file_name, read_only=True) if os.path.exists(file_name) else None
+        wb = Workbook(write_only=True)
+        cols_by_sheet = dict(self._sheets())
+        tmp = file_name + ".tmp"
+        try:
+            order = list(src.sheetnames) if src is not None else []
+            order += [sheet for sheet in cols_by_sheet if sheet not in order]
+
+            for sheet in order:
+                ws = wb.create_sheet(sheet)
+                cols = cols_by_sheet.get(sheet)
+                if cols is None:
+                    # чужой лист — переносим как есть (только значения)
+                    for row in src[sheet].iter_rows(values_only=True):
+                        ws.append(row)
+                    continue
+
+                for i, w in enumerate(index[sheet]["widths"], start=1):
+                    ws.column_dimensions[get_column_letter(i)].width = min(w + 2, self.MAX_COL_WIDTH)
+                self._init_sheet(ws, cols)
+
+                if src is not None and sheet in src.sheetnames:
+                    for row in src[sheet].iter_rows(min_row=2, values_only=True):
+                        ws.append(row)
+                for row in new_rows[sheet]:
+                    ws.append(row)
+
+            wb.save(tmp)
+        finally:
+            if src is not None:
+                src.close()
+        os.replace(tmp, file_name)
+
+    def _init_sheet(self, ws, cols):
+        ws.freeze_panes = "A2"
+        header = []
+        for c in cols:
+            cell = WriteOnlyCell(ws, value=c)
+            cell.font = Font(bold=True)
+            header.append(cell)
+        ws.append(header)
+
+
+# =========================
+# CRAWL JOURNAL (чекпоинты для --resume)
+# =========================
+class CrawlJournal:
+    """
+    Append-only JSONL: каждая собранная запись (с не удавшимися подзапросами) + смещение
+    следующей страницы списка по типу. fsync пачками (каждые fsync_every записей или fsync_interval секунд) и на каждом смещении.
+    Недописанная при падении последняя строка при чтении игнорируется.
+    """
+
+    KINDS = {"legal": LegalEntity, "physical": PhysicalPerson}
+
+    def __init__(self, path: str, fsync_every: int = 20, fsync_interval: float = 2.0):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._fh = None
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        -> ({"legal": [LegalEntity...], "physical": [...]}, {"legal": offset, "physical": offset})
+        """
+        records = {k: [] for k in self.KINDS}
+        offsets = {k: 0 for k in self.KINDS}
+        for kind, entry in self._entries():
+            if "offset" in entry:
+                offsets[kind] = int(entry["offset"])
+            elif isinstance(entry.get("record"), dict):
+                records[kind].append(self._record(kind, entry))
+        return records, offsets
+
+    def scan(self):
+        """
+        -> ({"legal": {guid...}, "physical": {...}}, offsets) — как load(), но без самих записей
+        """
+        guids = {k: set() for k in self.KINDS}
+        offsets = {k: 0 for k in self.KINDS}
+        for kind, entry in self._entries():
+            if "offset" in entry:
+                offsets[kind] = int(entry["offset"])
+            elif isinstance(entry.get("record"), dict):
+                guids[kind].add(guid_from_url(entry["record"].get("sourceUrl")))
+        return guids, offsets
+
+    def replay(self) -> Iterator[Tuple[str, Any, List[str]]]:
+        """
+        -> (kind, запись, не удавшиеся подзапросы) в порядке журнала, по одной
+        """
+        for kind, entry in self._entries():
+            if "offset" not in entry and isinstance(entry.get("record"), dict):
+                yield kind, self._record(kind, entry), list(entry.get("failed") or ())
+
+    def _entries(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as fh:
+            for line in fh:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                kind = entry.get("kind")
+                if kind in self.KINDS:
+                    yield kind, entry
+
+    def _record(self, kind: str, entry: Dict[str, Any]):
+        cls = self.KINDS[kind]
+        fields = RECORD_FIELDS[cls]
+        return cls(**{k: x for k, x in entry["record"].items() if k in fields})
+
+    def open(self, resume: bool) -> None:
+        if not resume and os.path.exists(self.path):
+            log.warning("Журнал %s от прошлого запуска перезаписывается (для продолжения есть --resume)", self.path)
+        self._fh = open(self.path, "a" if resume else "w", encoding="utf-8")
+
+    def record(self, kind: str, rec, failed: Iterable[str] = ()) -> None:
+        entry = {"kind": kind, "record": record_dict(rec)}
+        if failed:
+            entry["failed"] = sorted(failed)
+        self._write(entry, force_sync=False)
+
+    def offset(self, kind: str, offset: int) -> None:
+        self._write({"kind": kind, "offset": offset}, force_sync=True)
+
+    def _write(self, entry: Dict[str, Any], force_sync: bool) -> None:
+        if self._fh is None:
+            return
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._fh.write(line)
+            self._pending += 1
+            if (force_sync or self._pending >= self.fsync_every
+                    or time.monotonic() - self._last_sync >= self.fsync_interval):
+                self._sync()
+
+    def _sync(self) -> None:
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._fh is not None:
+                self._sync()
+                self._fh.close()
+                self._fh = None
+
+    def clear(self) -> None:
+        """
+        Данные благополучно выгружены — журнал больше не нужен
+        """
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+# =========================
+# STREAM SINK (NDJSON/CSV по мере сбора)
+# =========================
+class RecordSink:
+    """
+    Потоковая выгрузка: каждая запись пишется сразу, как собрана, в <prefix>-<kind>-NNNN.<ndjson|csv>[.gz].
+    Файл закрывается и начинается следующий, когда превысит rotate_bytes (0 — без ротации).
+    Номера продолжаются после уже существующих файлов: прошлые выгрузки не перезаписываются,
+    а потребитель может забирать закрытые файлы, не дожидаясь конца сбора.
+    """
+
+    FORMATS = ("ndjson", "csv")
+
+    def __init__(self, prefix: str, fmt: str = "ndjson", compress: bool = False, rotate_bytes: int = 0):
+        if fmt not in self.FORMATS:
+            raise ValueError(f"Неизвестный формат {fmt}")
+        self.prefix = prefix
+        self.fmt = fmt
+        self.compress = compress
+        self.rotate_bytes = rotate_bytes
+        self.written = {"legal": 0, "physical": 0}
+        self._lock = threading.Lock()
+        self._files: Dict[str, Tuple[Any, Any, Any, Any]] = {}
+
+    def _next_path(self, kind: str) -> str:
+        folder = os.path.dirname(self.prefix) or "."
+        os.makedirs(folder, exist_ok=True)
+        pattern = re.compile(re.escape(os.path.basename(self.prefix)) + rf"-{kind}-(\d+)\.")
+        used = [int(m.group(1)) for m in map(pattern.match, os.listdir(folder)) if m]
+        ext = self.fmt + (".gz" if self.compress else "")
+        return f"{self.prefix}-{kind}-{max(used, default=0) + 1:04d}.{ext}"
+
+    def _open(self, kind: str):
+        path = self._next_path(kind)
+        raw = open(path, "wb")
+        stream = gzip.GzipFile(filename="", fileobj=raw, mode="wb") if self.compress else raw
+        text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+        writer = None
+        if self.fmt == "csv":
+            writer = csv.writer(text)
+            writer.writerow(["guid", *RECORD_FIELDS[RecordStore.TABLES[kind][1]]])
+        self._files[kind] = (raw, stream, text, writer)
+        log.info("Потоковая выгрузка %s: %s", kind, path)
+        return self._files[kind]
+
+    def write(self, kind: str, rec) -> None:
+        guid = guid_from_url(rec.sourceUrl)
+        with self._lock:
+            raw, stream, text, writer = self._files.get(kind) or self._open(kind)
+            if writer is None:
+                text.write(json.dumps({"guid": guid, **record_dict(rec)}, ensure_ascii=False) + "\n")
+            else:
+                writer.writerow([guid, *record_values(rec)])
+            self.written[kind] += 1
+            # размер на диске отстаёт на буферы — для ротации этого достаточно
+            if self.rotate_bytes and raw.tell() >= self.rotate_bytes:
+                self._close(kind)
+
+    def flush(self) -> None:
+        """
+        Дописанное становится видно читателю (для gzip — sync flush)
+        """
+        with self._lock:
+            for raw, stream, text, _ in self._files.values():
+                text.flush()
+                if stream is not raw:
+                    stream.flush()
+                raw.flush()
+
+    def _close(self, kind: str) -> None:
+        raw, stream, text, _ = self._files.pop(kind)
+        text.close()
+        if not raw.closed:
+            raw.close()
+
+    def close(self) -> None:
+        with self._lock:
+            for kind in list(self._files):
+                self._close(kind)
+
+
+# =========================
+# CRAWL ENGINE (конвейер: списки -> карточки -> запись)
+# =========================
+@dataclass
+class CrawlTask:
+    """
+    Что собирать по одному типу.
+    known_guids — уже сохранённые GUID: их карточки не запрашиваем.
+    stop_after_known — списки отсортированы от новых к старым, поэтому после
+    стольких известных GUID подряд дальше листать незачем (0 — не останавливаться).
+    start_offset / done — продолжение по журналу: смещение и уже собранные записи;
+    done_guids — то же без самих записей (они переносятся в хранилище потоком, в памяти только GUID).
+    end_offset — не листать дальше этого смещения (единица работы шарда; 0 — без ограничения).
+    """
+    is_legal: bool
+    target: int
+    limit: int
+    known_guids: set = field(default_factory=set)
+    stop_after_known: int = 0
+    start_offset: int = 0
+    done: list = field(default_factory=list)
+    end_offset: int = 0
+    done_guids: set = field(default_factory=set)
+
+    @property
+    def kind(self) -> str:
+        return "legal" if self.is_legal else "physical"
+
+    @property
+    def resumed(self) -> set:
+        """
+        GUID, уже собранные по журналу
+        """
+        return self.done_guids.union(guid_from_url(r.sourceUrl) for r in self.done)
+
+
+class _PageTracker:
+    """
+    Смещение списка, до которого все страницы полностью записаны (для журнала)
+    """
+
+    def __init__(self, start_offset: int):
+        self.committed = start_offset
+        self._pages: "OrderedDict[int, List[int]]" = OrderedDict()
+
+    def add_page(self, page_offset: int, next_offset: int, items: int) -> bool:
+        self._pages[page_offset] = [next_offset, items]
+        return self._advance()
+
+    def item_done(self, page_offset: int) -> bool:
+        self._pages[page_offset][1] -= 1
+        return self._advance()
+
+    def _advance(self) -> bool:
+        moved = False
+        while self._pages:
+            page_offset, (next_offset, remaining) = next(iter(self._pages.items()))
+            if remaining > 0:
+                break
+            self._pages.popitem(last=False)
+            self.committed = next_offset
+            moved = True
+        return moved
+
+
+class _Stopped(Exception):
+    pass
+
+
+class _ListPager:
+    """
+    Листает живой список, выравниваясь по последнему виденному GUID (якорю).
+    Страница запрашивается с захватом overlap элементов до ожидаемого начала, и в захвате ищется якорь:
+    новые банкроты в начале списка сдвигают элементы вниз (без выравнивания они пришли бы повторно),
+    удаления — вверх (без него часть элементов была бы пропущена).
+    """
+
+    def __init__(self, api: ApiService, is_legal: bool, offset: int, overlap: int):
+        self.api = api
+        self.is_legal = is_legal
+        self.offset = offset
+        self.overlap = max(0, overlap)
+        self.anchor: Optional[str] = None
+        self.realigned = 0
+        self.shift = 0
+
+    def fetch(self, limit: int) -> List[Dict[str, Any]]:
+        """
+        Следующие (до limit) элементы после якоря; self.offset переходит на их конец
+        """
+        while True:
+            if self.anchor is None or not self.overlap:
+                items = self.api.fetch_list_items(self.is_legal, self.offset, limit)
+                self._advance(self.offset, items)
+                return items
+
+            for back in (self.overlap, self.overlap + limit):
+                start = max(0, self.offset - back)
+                want = limit + self.offset - start
+                raw = self.api.fetch_list_items(self.is_legal, start, want, lead=self.offset - start)
+                guids = [v(x.get("guid")) for x in raw]
+                if self.anchor in guids:
+                    pos = guids.index(self.anchor) + 1
+                    drift = start + pos - self.offset
+                    if drift:
+                        self.realigned += 1
+                        self.shift += abs(drift)
+                    items = raw[pos:]
+                    self._advance(start + pos, items)
+                    break
+                if not raw or start == 0:
+                    # якоря нет и дальше искать некуда — берём как есть, повторы отсеет реестр GUID
+                    items = raw[self.offset - start:]
+                    self._advance(self.offset, items)
+                    break
+            else:
+                # якорь ушёл дальше страницы (очень много новых записей) — берём как есть
+                self.realigned += 1
+                items = raw[self.offset - start:]
+                self._advance(self.offset, items)
+
+            # вся страница оказалась уже виденной, но список не кончился — листаем дальше
+            if items or len(raw) < want:
+                return items
+
+    def _advance(self, start: int, items: List[Dict[str, Any]]) -> None:
+        self.offset = start + len(items)
+        if items:
+            self.anchor = v(items[-1].get("guid"))
+
+
+class _GuidRegistry:
+    """
+    GUID, уже взятые в работу за прогон (общий для всех продюсеров): повтор из-за сдвига страниц
+    или пересечения задач отсеивается до того, как по нему пойдут запросы карточки
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seen: set = set()
+
+    def claim(self, kind: str, guid: str) -> bool:
+        key = (kind, guid)
+        with self._lock:
+            if key in self._seen:
+                return False
+            self._seen.add(key)
+            return True
+
+
+class _BackfillFeed:
+    """
+    Общий для воркеров курсор по очереди дозаполнения в хранилище.
+    Каждую запись очереди за прогон берёт только один воркер.
+    """
+
+    IDLE_RECHECK = 5.0
+
+    def __init__(self, store: RecordStore, batch: int = 100):
+        self.store = store
+        self.batch = batch
+        self._lock = threading.Lock()
+        self._last_id = 0
+        self._buf: deque = deque()
+        self._empty_until = 0.0
+
+    def take(self) -> Optional[Tuple[int, str, str, Tuple[str, ...]]]:
+        with self._lock:
+            if not self._buf:
+                # очередь пуста — не дёргаем базу на каждом простое воркера
+                if time.monotonic() < self._empty_until:
+                    return None
+                self._buf.extend(self.store.next_backfill(self._last_id, self.batch))
+                if not self._buf:
+                    self._empty_until = time.monotonic() + self.IDLE_RECHECK
+                    return None
+                self._last_id = self._buf[-1][0]
+            return self._buf.popleft()
+
+
+class CrawlEngine:
+    """
+    Конвейер:
+      продюсеры (по потоку на тип) листают списки и кладут элементы в ограниченную очередь;
+      воркеры собирают карточки; писатель пачками пишет результаты в журнал и хранилище.
+    Очереди ограничены, поэтому продюсер опережает воркеров не больше чем на очередь,
+    и память не растёт. Темп и потолок запросов задаёт ApiService (limiters / host_limits).
+
+    endpoints — подзапросы карточки при сборе (None — все, см. ApiService.ENRICHMENT_PROFILES);
+    defer — подзапросы, которые откладываются: GUID ставится в очередь дозаполнения хранилища.
+    Очередь дозаполнения разбирают воркеры, когда им нечего делать (idle_backfill),
+    и метод backfill() — до опустошения.
+    sink — потоковая выгрузка каждой новой записи; keep_results=False — не копить записи
+    в памяти (run() вернёт пустые списки), память не зависит от target.
+    """
+
+    # через сколько секунд повторять подзапросы, не удавшиеся из-за недоступности эндпоинта
+    RETRY_BACKFILL_AFTER = 600.0
+
+    def __init__(self, api: ApiService, workers: int = 4, journal: Optional[CrawlJournal] = None,
+                 store: Optional[RecordStore] = None, queue_size: int = 0, batch_size: int = 50,
+                 endpoints: Optional[Iterable[str]] = None, defer: Iterable[str] = (),
+                 idle_backfill: bool = True, page_overlap: int = 5, sink: Optional[RecordSink] = None,
+                 keep_results: bool = True):
+        self.api = api
+        self.workers = max(1, workers)
+        self.journal = journal
+        self.store = store
+        self.queue_size = queue_size or self.workers * 4
+        self.batch_size = max(1, batch_size)
+        self.endpoints = None if endpoints is None else frozenset(endpoints)
+        self.defer = frozenset(defer)
+        self.idle_backfill = idle_backfill and store is not None
+        self.page_overlap = page_overlap
+        self.sink = sink
+        self.keep_results = keep_results
+        self._seen = _GuidRegistry()
+        if self.defer and store is None:
+            raise ValueError("Отложенное обогащение требует хранилища")
+        # счётчики backfill()/refresh(): записей обработано / изменилось в хранилище
+        self.filled = 0
+        self.changed = 0
+        # refresh(): записей, не найденных в списке (поля списка остались прежними)
+        self.unmatched = 0
+        self._unmatched_lock = threading.Lock()
+
+        self._stop = threading.Event()
+        self._error: Optional[BaseException] = None
+
+    def run(self, tasks: List[CrawlTask]) -> Dict[str, list]:
+        """
+        Собирает все задачи одновременно, возвращает {kind: [записи]} (включая task.done;
+        пустые при keep_results=False)
+        """
+        self._stop.clear()
+        self._error = None
+        work_q: "queue.Queue" = queue.Queue(maxsize=self.queue_size)
+        result_q: "queue.Queue" = queue.Queue(maxsize=self.queue_size * 2)
+        results = {t.kind: list(t.done) if self.keep_results else [] for t in tasks}
+        feed = _BackfillFeed(self.store) if self.idle_backfill else None
+        self._seen = _GuidRegistry()
+        for t in tasks:
+            for guid in t.resumed:
+                self._seen.claim(t.kind, guid)
+
+        producers = [self._spawn(f"fedresurs-list-{t.kind}", self._produce, t, work_q, result_q) for t in tasks]
+        consumers = [self._spawn(f"fedresurs-deep-{i}", self._consume, work_q, result_q, feed)
+                     for i in range(self.workers)]
+        writer = self._spawn("fedresurs-writer", self._write, tasks, result_q, results)
+
+        try:
+            self._join(producers)
+            for _ in consumers:
+                self._put(work_q, None)
+            self._join(consumers)
+            self._put(result_q, None)
+            self._join([writer])
+        except _Stopped:
+            pass
+        except BaseException:
+            self._stop.set()
+            raise
+
+        if self._error is not None:
+            raise self._error
+        return results
+
+    def backfill(self) -> int:
+        """
+        Разбирает очередь дозаполнения хранилища до конца, -> сколько записей дозаполнено
+        """
+        if self.store is None:
+            return 0
+        feed = _BackfillFeed(self.store)
+        feed.IDLE_RECHECK = 0.0
+        self._run_fillers("backfill", lambda result_q: self._backfill_one(feed, result_q))
+        return self.filled
+
+    def replay(self, entries: Iterable[Tuple[str, Any, List[str]]]) -> int:
+        """
+        Переносит в хранилище записи журнала прерванного запуска (kind, запись, не удавшиеся подзапросы),
+        -> сколько перенесено. Как при сборе: поля не запрошенных профилем и не удавшихся подзапросов
+        не затирают сохранённые, а эти подзапросы (и отложенные) ставятся в очередь дозаполнения
+        """
+        if self.store is None:
+            return 0
+        batches: Dict[Tuple[str, frozenset], list] = {}
+
+        def write(kind: str, failed: frozenset, batch: list) -> None:
+            self.store.upsert(kind, batch, keep_fields=self._keep_fields(kind, failed))
+            endpoints = failed | self.defer
+            if endpoints:
+                self.store.queue_backfill(kind, (guid_from_url(r.sourceUrl) for r in batch), endpoints)
+            batch.clear()
+
+        replayed = 0
+        for kind, rec, failed in entries:
+            key = (kind, frozenset(failed))
+            batch = batches.setdefault(key, [])
+            batch.append(rec)
+            replayed += 1
+            if len(batch) >= self.batch_size:
+                write(*key, batch)
+        for key, batch in batches.items():
+            if batch:
+                write(*key, batch)
+        return replayed
+
+    def refresh(self, kinds: Iterable[str] = ("legal", "physical"), active_only: bool = False) -> Tuple[int, int]:
+        """
+        Заново собирает уже сохранённые записи (свежий элемент списка + подзапросы профиля endpoints)
+        и обновляет в хранилище только изменившиеся, -> (проверено, изменено)
+        """
+        if self.store is None:
+            return 0, 0
+        todo = [(kind, guid, inn) for kind in kinds
+                for guid, inn, active, _ in self.store.iter_refresh_state(kind) if active or not active_only]
+        log.info("На обновление: %d записей", len(todo))
+        return self.refresh_items(todo)
+
+    def refresh_items(self, items: Iterable[Tuple[str, str, str]]) -> Tuple[int, int]:
+        """
+        Обновляет записи (kind, guid, ИНН), -> (проверено, изменено)
+        """
+        todo = deque(items)
+
+        def take(result_q: "queue.Queue") -> bool:
+            try:
+                kind, guid, inn = todo.popleft()
+            except IndexError:
+                return False
+            failed: List[str] = []
+            rec, fresh = self.refetch(kind, guid, inn, failed)
+            if not fresh:
+                with self._unmatched_lock:
+                    self.unmatched += 1
+            # запись из хранилища уже несёт прежние значения; у свежей сохраняем только поля
+            # не запрошенных и не удавшихся подзапросов — остальное может законно опустеть
+            keep = self._keep_fields(kind, failed) if fresh else frozenset()
+            self._put(result_q, ("fill", kind, None, rec, failed, keep))
+            return True
+
+        self.unmatched = 0
+        self._run_fillers("refresh", take)
+        if self.unmatched:
+            log.warning("Не найдено в списке: %d записей — статус и дело не обновлены, "
+                        "подзапросы дозаполнены по сохранённой записи", self.unmatched)
+        return self.filled, self.changed
+
+    def refetch(self, kind: str, guid: str, inn: str, failed: Optional[List[str]] = None) -> Tuple[Any, bool]:
+        """
+        Собирает сохранённую запись заново, -> (запись, собрана ли с нуля по свежему элементу списка).
+        Поля списка (статус, № дела, управляющий) берутся из поиска по ИНН; у ФЛ без ИНН —
+        по СНИЛС, затем по ФИО (совпадение всё равно по guid). Если элемент не нашёлся —
+        поля списка остаются прежними.
+        """
+        is_legal = kind == "legal"
+        rec = None
+        item = self.api.find_list_item(is_legal, guid, inn)
+        if item is None and not inn and not is_legal:
+            rec = self.store.get(kind, guid)
+            for search in (rec.snils, rec.fullName) if rec is not None else ():
+                item = self.api.find_list_item(is_legal, guid, search)
+                if item is not None:
+                    break
+        if item is not None:
+            fetch = self.api.fetch_legal_full_details if is_legal else self.api.fetch_physical_full_details
+            return fetch(item, self.endpoints, failed), True
+        log.debug("%s %s не найден в списке (ИНН %r) — поля списка не обновлены", kind, guid, inn)
+        if rec is None:
+            rec = self.store.get(kind, guid)
+        if rec is None:
+            return None, False
+        enrich = self.api.enrich_legal if is_legal else self.api.enrich_physical
+        missed = enrich(rec, self.endpoints)
+        if failed is not None:
+            failed.extend(missed)
+        return rec, False
+
+    def _keep_fields(self, kind: str, failed: Iterable[str] = ()) -> frozenset:
+        # поля свежесобранной записи, которые не должны затирать сохранённые (профиль + неудачи)
+        return ApiService.keep_fields(kind, self.endpoints, failed)
+
+    def _run_fillers(self, name: str, step: Callable[["queue.Queue"], bool]) -> None:
+        # воркеры вызывают step, пока он не вернёт False; результаты пишет общий писатель
+        self._stop.clear()
+        self._error = None
+        self.filled = 0
+        self.changed = 0
+        result_q: "queue.Queue" = queue.Queue(maxsize=self.queue_size * 2)
+
+        def drain():
+            while step(result_q):
+                pass
+
+        fillers = [self._spawn(f"fedresurs-{name}-{i}", drain) for i in range(self.workers)]
+        writer = self._spawn("fedresurs-writer", self._write, [], result_q, {})
+        try:
+            self._join(fillers)
+            self._put(result_q, None)
+            self._join([writer])
+        except _Stopped:
+            pass
+        except BaseException:
+            self._stop.set()
+            raise
+
+        if self._error is not None:
+            raise self._error
+
+    # --- служебное: потоки и очереди с остановкой
+
+    def _spawn(self, name: str, fn: Callable, *args) -> threading.Thread:
+        if self.api.profiler is not None:
+            fn = self.api.profiler.wrap(fn)
+
+        def guarded():
+            try:
+                fn(*args)
+            except _Stopped:
+                pass
+            except BaseException as ex:
+                if self._error is None:
+                    self._error = ex
+                self._stop.set()
+
+        t = threading.Thread(target=guarded, name=name, daemon=True)
+        t.start()
+        return t
+
+    def _join(self, threads: List[threading.Thread]) -> None:
+        # join с таймаутом, чтобы Ctrl-C доходил до главного потока
+        for t in threads:
+            while t.is_alive():
+                t.join(0.5)
+        if self._stop.is_set():
+            raise _Stopped()
+
+    def _put(self, q: "queue.Queue", item: Any) -> None:
+        while True:
+            if self._stop.is_set():
+                raise _Stopped()
+            try:
+                q.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, q: "queue.Queue", timeout: Optional[float] = None) -> Any:
+        """
+        timeout=None — ждать, пока не придёт сообщение; иначе queue.Empty по истечении
+        """
+        while True:
+            if self._stop.is_set():
+                raise _Stopped()
+            try:
+                return q.get(timeout=0.5 if timeout is None else timeout)
+            except queue.Empty:
+                if timeout is None:
+                    continue
+                raise
+
+    # --- стадии
+
+    def _produce(self, task: CrawlTask, work_q: "queue.Queue", result_q: "queue.Queue") -> None:
+        resumed = task.resumed
+        known = set(task.known_guids)
+        known.update(resumed)
+        queued = len(resumed)
+        known_run = 0
+        skipped = 0
+        duplicates = 0
+
+        pager = _ListPager(self.api, task.is_legal, task.start_offset, self.page_overlap)
+        while queued < task.target:
+            offset = pager.offset
+            # страница растёт, пока сервер отвечает быстро, но не больше, чем осталось собрать
+            limit = min(self.api.list_page_size(task.is_legal, task.limit),
+                        max(task.limit, task.target - queued))
+            if task.end_offset:
+                if offset >= task.end_offset:
+                    break
+                limit = min(limit, task.end_offset - offset)
+
+            items = pager.fetch(limit)
+            if not items:
+                break
+
+            fresh = []
+            reached_known = False
+            for item in items:
+                guid = v(item.get("guid"))
+                if guid in known:
+                    skipped += 1
+                    known_run += 1
+                    if task.stop_after_known and known_run >= task.stop_after_known:
+                        reached_known = True
+                        break
+                    continue
+                known_run = 0
+                if queued + len(fresh) >= task.target:
+                    continue
+                if not self._seen.claim(task.kind, guid):
+                    duplicates += 1
+                    continue
+                fresh.append(item)
+
+            # страницу регистрируем у писателя раньше, чем её элементы попадут к воркерам
+            self._put(result_q, ("page", task, offset, pager.offset, len(fresh)))
+            for item in fresh:
+                self._put(work_q, (task, offset, item))
+            queued += len(fresh)
+
+            if reached_known:
+                log.info("Дошли до %d уже известных GUID подряд — дальше список не листаем", known_run)
+                break
+
+        if skipped:
+            log.info("Пропущено уже известных GUID: %d", skipped)
+        if pager.realigned or duplicates:
+            log.info("Список %s сдвигался во время обхода: выравниваний %d (на %d элементов), "
+                     "повторов GUID отсеяно %d", task.kind, pager.realigned, pager.shift, duplicates)
+
+    def _consume(self, work_q: "queue.Queue", result_q: "queue.Queue", feed: Optional[_BackfillFeed]) -> None:
+        while True:
+            if feed is None:
+                msg = self._get(work_q)
+            else:
+                try:
+                    msg = self._get(work_q, timeout=0.1)
+                except queue.Empty:
+                    # карточек из списков нет — время простоя отдаём дозаполнению
+                    self._backfill_one(feed, result_q)
+                    continue
+            if msg is None:
+                return
+            task, page_offset, item = msg
+            fetch = self.api.fetch_legal_full_details if task.is_legal else self.api.fetch_physical_full_details
+            failed: List[str] = []
+            rec = fetch(item, self.endpoints, failed)
+            self._put(result_q, ("rec", task, page_offset, rec, failed))
+
+    def _backfill_one(self, feed: _BackfillFeed, result_q: "queue.Queue") -> bool:
+        entry = feed.take()
+        if entry is None:
+            return False
+        bf_id, kind, guid, endpoints = entry
+        rec = self.store.get(kind, guid)
+        failed: List[str] = []
+        if rec is not None:
+            enrich = self.api.enrich_legal if kind == "legal" else self.api.enrich_physical
+            failed = enrich(rec, endpoints)
+        # запись взята из хранилища: не дозаполненные поля и так прежние
+        self._put(result_q, ("fill", kind, bf_id, rec, failed, frozenset()))
+        return True
+
+    def _write(self, tasks: List[CrawlTask], result_q: "queue.Queue", results: Dict[str, list]) -> None:
+        trackers = {t.kind: _PageTracker(t.start_offset) for t in tasks}
+        counts = {t.kind: len(t.resumed) for t in tasks}
+        pending: Dict[str, list] = {t.kind: [] for t in tasks}
+        # дозаполненные/обновлённые и собранные с неудачными подзапросами: kind -> [(запись, keep_fields)]
+        filled: Dict[str, list] = {"legal": [], "physical": []}
+        filled_ids: List[int] = []
+        # подзапросы, не удавшиеся из-за недоступности эндпоинта: kind -> [(guid, endpoints)]
+        retry: Dict[str, list] = {"legal": [], "physical": []}
+        # без хранилища повторять их некуда: эндпоинт -> сколько записей осталось без его полей
+        dropped: Dict[str, int] = {}
+
+        def flush():
+            with self.api._timed("export"):
+                if self.sink is not None:
+                    self.sink.flush()
+            with self.api._timed("store"):
+                write()
+
+        def write():
+            if self.store is None:
+                for items in retry.values():
+                    for _, endpoints in items:
+                        for ep in endpoints:
+                            dropped[ep] = dropped.get(ep, 0) + 1
+                for batches in (pending, filled, retry):
+                    for batch in batches.values():
+                        batch.clear()
+                return
+            for kind, batch in pending.items():
+                if batch:
+                    # не запрошенные по профилю поля пусты — собранное раньше не затираем
+                    self.store.upsert(kind, batch, keep_fields=self._keep_fields(kind))
+                    if self.defer:
+                        self.store.queue_backfill(kind, (guid_from_url(r.sourceUrl) for r in batch), self.defer)
+                    batch.clear()
+            for kind, batch in filled.items():
+                # неудачный подзапрос не должен стирать то, что уже собрано, — пачками по набору полей
+                groups: Dict[frozenset, list] = {}
+                for rec, keep in batch:
+                    groups.setdefault(keep, []).append(rec)
+                for keep, recs in groups.items():
+                    self.changed += self.store.upsert(kind, recs, keep_fields=keep)
+                batch.clear()
+            if filled_ids:
+                self.store.complete_backfill(filled_ids)
+                filled_ids.clear()
+            # после complete_backfill: повторная постановка того же GUID не должна быть тут же удалена
+            for kind, items in retry.items():
+                for guid, endpoints in items:
+                    self.store.queue_backfill(kind, [guid], endpoints, delay=self.RETRY_BACKFILL_AFTER)
+                items.clear()
+
+        while True:
+            try:
+                msg = result_q.get(timeout=1.0)
+            except queue.Empty:
+                # простой — сбрасываем накопленное
+                flush()
+                if self._stop.is_set():
+                    raise _Stopped()
+                continue
+            if msg is None:
+                break
+
+            if msg[0] == "fill":
+                _, kind, bf_id, rec, failed, keep = msg
+                if rec is not None:
+                    filled[kind].append((rec, keep))
+                    self.filled += 1
+                    if failed:
+                        retry[kind].append((guid_from_url(rec.sourceUrl), failed))
+                if bf_id is not None:
+                    filled_ids.append(bf_id)
+                if len(filled[kind]) >= self.batch_size or len(filled_ids) >= self.batch_size:
+                    flush()
+                continue
+
+            task = msg[1]
+            kind = task.kind
+            tracker = trackers[kind]
+            if msg[0] == "page":
+                _, _, page_offset, next_offset, n = msg
+                moved = tracker.add_page(page_offset, next_offset, n)
+            else:
+                _, _, page_offset, rec, failed = msg
+                counts[kind] += 1
+                if self.keep_results:
+                    results[kind].append(rec)
+                if failed:
+                    # недоступные подзапросы (и отложенные) — на повтор позже; пустые поля не затирают прежние
+                    retry[kind].append((guid_from_url(rec.sourceUrl), set(failed) | self.defer))
+                    filled[kind].append((rec, self._keep_fields(kind, failed)))
+                else:
+                    pending[kind].append(rec)
+                self.api.metrics.record(kind)
+                if self.journal is not None:
+                    with self.api._timed("store"):
+                        self.journal.record(kind, rec, failed)
+                if self.sink is not None:
+                    with self.api._timed("export"):
+                        self.sink.write(kind, rec)
+                self._log_record(task.is_legal, rec, counts[kind], task.target)
+                moved = tracker.item_done(page_offset)
+                if len(pending[kind]) + len(filled[kind]) >= self.batch_size:
+                    flush()
+
+            if moved and self.journal is not None:
+                with self.api._timed("store"):
+                    self.journal.offset(kind, tracker.committed)
+
+        flush()
+        if dropped:
+            log.warning("Без хранилища не удавшиеся подзапросы не ставятся на дозаполнение — их поля "
+                        "остались пустыми: %s", ", ".join(f"{ep}={n}" for ep, n in sorted(dropped.items())))
+
+    def _log_record(self, is_legal: bool, rec, n: int, target: int) -> None:
+        if is_legal:
+            log.info(f"[{n}/{target}] ЮЛ: {rec.fullName} (GUID найден)")
+        else:
+            status_info = "+ История имен" if v(rec.previousFullName) else ""
+            log.info(f"[{n}/{target}] ФЛ: {rec.fullName} {status_info}".strip())
+
+
+# =========================
+# SHARDING (план -> воркеры -> слияние)
+# =========================
+@dataclass
+class WorkUnit:
+    """
+    Диапазон смещений [offset, end) одного списка
+    """
+    id: str
+    kind: str
+    offset: int
+    end: int
+
+
+def plan_shards(api: ApiService, unit_size: int, limit_per_kind: int = 0) -> List[WorkUnit]:
+    units = []
+    for is_legal, kind in ((True, "legal"), (False, "physical")):
+        total = api.fetch_list_total(is_legal)
+        if total is None:
+            raise RuntimeError(f"Не удалось узнать размер списка {kind} (нет поля total)")
+        if limit_per_kind:
+            total = min(total, limit_per_kind)
+        for i, start in enumerate(range(0, total, unit_size)):
+            units.append(WorkUnit(f"{kind}-{i:05d}", kind, start, min(start + unit_size, total)))
+    return units
+
+
+def save_units(path: str, units: List[WorkUnit]) -> None:
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump({"units": [asdict(u) for u in units]}, fh, ensure_ascii=False, indent=1)
+
+
+def load_units(path: str) -> List[WorkUnit]:
+    with open(path, encoding="utf-8") as fh:
+        return [WorkUnit(**u) for u in json.load(fh)["units"]]
+
+
+def run_shard_unit(api: ApiService, unit: WorkUnit, shard_dir: str, workers: int, page_size: int,
+                   endpoints: Optional[Iterable[str]] = None) -> Optional[int]:
+    """
+    Собирает единицу работы в свой шард <shard_dir>/<id>.sqlite3 (с журналом для продолжения).
+    Готовый шард помечается файлом .done и при повторном запуске пропускается (-> None).
+    """
+    db_path = os.path.join(shard_dir, f"{unit.id}.sqlite3")
+    if os.path.exists(db_path + ".done"):
+        return None
+
+    journal = CrawlJournal(os.path.join(shard_dir, f"{unit.id}.jsonl"))
+    resumed, offsets = journal.scan()
+    journal.open(resume=True)
+    store = RecordStore(db_path)
+    try:
+        task = CrawlTask(unit.kind == "legal", unit.end - unit.offset, page_size,
+                         start_offset=max(unit.offset, offsets[unit.kind]), end_offset=unit.end,
+                         done_guids=resumed[unit.kind])
+        engine = CrawlEngine(api, workers=workers, journal=journal, store=store, endpoints=endpoints,
+                             idle_backfill=False, keep_results=False)
+        engine.replay(journal.replay())
+        engine.run([task])
+        collected = store.count(unit.kind)
+    finally:
+        store.close()
+        journal.close()
+
+    open(db_path + ".done", "w").close()
+    journal.clear()
+    return collected
+
+
+def _shard_process(args: argparse.Namespace, unit: WorkUnit) -> Tuple[WorkUnit, Optional[int]]:
+    # точка входа процесса-воркера (multiprocessing, spawn)
+    api = build_api(args)
+    try:
+        return unit, run_shard_unit(api, unit, args.shard_dir, args.workers, args.page_size,
+                                    ApiService.ENRICHMENT_PROFILES[args.enrich])
+    finally:
+        api.close()
+
+
+def _log_shard(unit: WorkUnit, count: Optional[int]) -> None:
+    if count is None:
+        log.info("Шард %s [%d..%d) уже собран — пропуск", unit.id, unit.offset, unit.end)
+    else:
+        log.info("Шард %s [%d..%d) готов: %d записей", unit.id, unit.offset, unit.end, count)
+
+
+def merge_shards(store: RecordStore, shard_dir: str, endpoints: Optional[Iterable[str]] = None) -> Dict[str, int]:
+    total = {"legal": 0, "physical": 0, "backfill": 0}
+    for name in sorted(os.listdir(shard_dir)):
+        if not name.endswith(".sqlite3"):
+            continue
+        merged = store.merge_from(os.path.join(shard_dir, name), endpoints)
+        for kind, n in merged.items():
+            total[kind] += n
+    return total
+
+
+def run_shard_command(args: argparse.Namespace) -> None:
+    exporter = ExcelExporter()
+    os.makedirs(args.shard_dir, exist_ok=True)
+
+    if args.command in ("shard-plan", "shard"):
+        if args.command == "shard" and os.path.exists(args.units):
+            units = load_units(args.units)
+            log.info("План %s уже есть: %d единиц работы", args.units, len(units))
+        else:
+            api = build_api(args)
+            try:
+                units = plan_shards(api, args.unit_size, args.shard_limit)
+            finally:
+                api.close()
+            save_units(args.units, units)
+            log.info("План сохранён в %s: %d единиц работы по %d записей", args.units, len(units), args.unit_size)
+        if args.command == "shard-plan":
+            return
+
+    if args.command in ("shard-work", "shard"):
+        units = load_units(args.units)
+        if args.command == "shard-work":
+            # узел № worker_index из worker_count берёт каждую worker_count-ю единицу
+            units = units[args.worker_index::args.worker_count]
+            api = build_api(args)
+            try:
+                for unit in units:
+                    _log_shard(unit, run_shard_unit(api, unit, args.shard_dir, args.workers, args.page_size,
+                                                    ApiService.ENRICHMENT_PROFILES[args.enrich]))
+            finally:
+                api.metrics.log_summary()
+                api.close()
+            return
+
+        # локальные процессы выходят в сеть с одного адреса — делим между ними бюджет скорости и соединений
+        child = argparse.Namespace(**vars(args))
+        n = max(1, args.processes)
+        child.bankrot_rps = args.bankrot_rps / n
+        child.fedresurs_rps = args.fedresurs_rps / n
+        child.bankrot_concurrency = max(1, args.bankrot_concurrency // n)
+        child.fedresurs_concurrency = max(1, args.fedresurs_concurrency // n)
+        with multiprocessing.get_context("spawn").Pool(n) as pool:
+            for unit, count in pool.starmap(_shard_process, [(child, u) for u in units]):
+                _log_shard(unit, count)
+
+    store = RecordStore(args.db)
+    try:
+        merged = merge_shards(store, args.shard_dir, ApiService.ENRICHMENT_PROFILES[args.enrich])
+        log.info("Слияние шардов из %s в %s: ЮЛ=%d, ФЛ=%d, в очередь дозаполнения=%d", args.shard_dir, args.db,
+                 merged["legal"], merged["physical"], merged["backfill"])
+        if merged["backfill"]:
+            log.info("Подзапросы, не удавшиеся в шардах, ждут в очереди дозаполнения — команда backfill")
+        if not args.no_report:
+            exporter.export_report(store, args.output)
+    finally:
+        store.close()
+
+
+# =========================
+# SCHEDULER (демон обновлений в пределах бюджета запросов)
+# =========================
+class RefreshScheduler:
+    """
+    Долгоживущий режим вместо перезапусков по cron.
+    Очереди GUID по сроку следующей проверки: активные дела проверяются раз в active_interval,
+    завершённые — раз в completed_interval (секунды). Раз в poll_interval списки опрашиваются
+    на новых банкротов (как --incremental). Запросы тратятся не больше budget_per_hour в час:
+    сначала опрос списков, затем просроченные активные дела, затем завершённые.
+    """
+
+    # сколько бюджета может накопиться за простой (доля часа) — чтобы не было залпа после паузы
+    BURST_SHARE = 1 / 12
+    MAX_SLEEP = 30.0
+
+    def __init__(self, engine: CrawlEngine, store: RecordStore, active_interval: float,
+                 completed_interval: float, poll_interval: float, budget_per_hour: float,
+                 poll_target: int, page_size: int, stop_after_known: int, batch: int = 50,
+                 report: Optional[Callable[[], None]] = None, report_interval: float = 3600.0):
+        self.engine = engine
+        self.store = store
+        self.intervals = {True: active_interval, False: completed_interval}
+        self.poll_interval = poll_interval
+        self.budget_per_hour = budget_per_hour
+        self.poll_target = poll_target
+        self.page_size = page_size
+        self.stop_after_known = stop_after_known
+        self.batch = max(1, batch)
+        self.report = report
+        self.report_interval = report_interval
+
+        # куча (срок, kind, guid, ИНН) отдельно для активных и завершённых дел
+        self._due: Dict[bool, list] = {True: [], False: []}
+        self._tokens = budget_per_hour * self.BURST_SHARE
+        self._refilled = time.monotonic()
+        # оценка запросов на одну запись, уточняется по факту
+        self._per_record = 5.0
+
+    def _spent(self) -> int:
+        return self.engine.api.metrics.total("requests", "timeouts", "network_errors")
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        cap = self.budget_per_hour * self.BURST_SHARE
+        self._tokens = min(cap, self._tokens + (now - self._refilled) * self.budget_per_hour / 3600.0)
+        self._refilled = now
+
+    def schedule(self, kind: str, guid: str, inn: str, active: bool, checked_at: float) -> None:
+        heapq.heappush(self._due[active], (checked_at + self.intervals[active], kind, guid, inn))
+
+    def load(self) -> None:
+        for kind in RecordStore.TABLES:
+            for guid, inn, active, checked_at in self.store.iter_refresh_state(kind):
+                self.schedule(kind, guid, inn, active, checked_at)
+        log.info("Планировщик: активных дел %d, завершённых %d", len(self._due[True]), len(self._due[False]))
+
+    def _take_due(self, now: float, n: int) -> List[Tuple[str, str, str]]:
+        out = []
+        for active in (True, False):
+            heap = self._due[active]
+            while heap and heap[0][0] <= now and len(out) < n:
+                _, kind, guid, inn = heapq.heappop(heap)
+                out.append((kind, guid, inn))
+        return out
+
+    def _next_due(self) -> float:
+        return min((heap[0][0] for heap in self._due.values() if heap), default=float("inf"))
+
+    def _spend(self, fn: Callable[[], Any]) -> Any:
+        before = self._spent()
+        try:
+            return fn()
+        finally:
+            self._tokens -= self._spent() - before
+
+    def _learn(self, requests: int, records: int) -> None:
+        if records:
+            self._per_record = 0.8 * self._per_record + 0.2 * (requests / records)
+
+    def poll(self) -> int:
+        """
+        Новые банкроты с начала списков, -> сколько записей добавлено
+        """
+        before = self._spent()
+        tasks = [CrawlTask(is_legal, self.poll_target, self.page_size,
+                           self.store.known_guids(kind), self.stop_after_known)
+                 for is_legal, kind in ((True, "legal"), (False, "physical"))]
+        collected = self._spend(lambda: self.engine.run(tasks))
+        added = 0
+        now = time.time()
+        for kind, recs in collected.items():
+            for rec in recs:
+                self.schedule(kind, guid_from_url(rec.sourceUrl), rec.inn, RecordStore.is_active(rec), now)
+            added += len(recs)
+        self._learn(self._spent() - before, added)
+        return added
+
+    def refresh_due(self, now: float) -> Tuple[int, int]:
+        n = min(self.batch, max(1, int(self._tokens / self._per_record)))
+        items = self._take_due(now, n)
+        if not items:
+            return 0, 0
+        before = self._spent()
+        checked, changed = self._spend(lambda: self.engine.refresh_items(items))
+        self._learn(self._spent() - before, len(items))
+
+        now = time.time()
+        for kind, guid, inn in items:
+            rec = self.store.get(kind, guid)
+            if rec is not None:
+                self.schedule(kind, guid, rec.inn, RecordStore.is_active(rec), now)
+        return checked, changed
+
+    def run(self, run_for: float = 0.0) -> None:
+        """
+        run_for — сколько секунд работать (0 — пока не прервут)
+        """
+        self.load()
+        deadline = time.monotonic() + run_for if run_for else float("inf")
+        next_poll = time.time()
+        last_report = time.monotonic()
+        dirty = False
+
+        while time.monotonic() < deadline:
+            self._refill()
+            now = time.time()
+            did = False
+
+            if self._tokens > 0 and now >= next_poll:
+                added = self.poll()
+                next_poll = now + self.poll_interval
+                dirty = dirty or added > 0
+                log.info("Планировщик: новых записей %d, бюджет %.0f запросов", added, self._tokens)
+                did = True
+            elif self._tokens > 0 and self._next_due() <= now:
+                checked, changed = self.refresh_due(now)
+                dirty = dirty or changed > 0
+                log.info("Планировщик: проверено %d, изменилось %d | в очереди активных %d, завершённых %d | "
+                         "бюджет %.0f запросов, ~%.1f на запись", checked, changed,
+                         len(self._due[True]), len(self._due[False]), self._tokens, self._per_record)
+                did = True
+
+            if dirty and self.report is not None and time.monotonic() - last_report >= self.report_interval:
+                self.report()
+                last_report = time.monotonic()
+                dirty = False
+            if did:
+                continue
+
+            # ждём ближайшего: срока проверки, опроса списков или пополнения бюджета
+            wake = min(self._next_due(), next_poll) - time.time()
+            if self._tokens <= 0:
+                wake = max(wake, -self._tokens * 3600.0 / self.budget_per_hour)
+            time.sleep(min(max(wake, 0.05), self.MAX_SLEEP, max(0.0, deadline - time.monotonic())))
+
+        if dirty and self.report is not None:
+            self.report()
+
+
+# =========================
+# LOOKUP (поиск по хранилищу: точный по реквизитам, полнотекстовый по ФИО/наименованию/адресу)
+# =========================
+class LookupService:
+    """
+    Запрос без указания поля разбирается сам: ИНН, ОГРН/ОГРНИП, СНИЛС, номер дела, GUID;
+    всё остальное ищется по полнотекстовому индексу. Индексы обновляются триггерами при каждой записи
+    """
+    GUID_RE = re.compile(r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$")
+    SNILS_RE = re.compile(r"^\d{3}-?\d{3}-?\d{3}[ -]?\d{2}$")
+    CASE_RE = re.compile(r"^[А-ЯA-Z]\d{2}-\d+/\d{4}", re.IGNORECASE)
+
+    def __init__(self, store: RecordStore):
+        self.store = store
+
+    def detect(self, query: str) -> List[Tuple[str, str, str]]:
+        """
+        -> [(kind, поле, значение)] для точного поиска; пусто — искать по тексту
+        """
+        q = query.strip()
+        digits = re.sub(r"[\s-]", "", q)
+        if self.GUID_RE.match(q):
+            return [("legal", "guid", q), ("physical", "guid", q)]
+        if self.SNILS_RE.match(q):
+            d = re.sub(r"\D", "", q)
+            return [("physical", "snils", f"{d[:3]}-{d[3:6]}-{d[6:9]} {d[9:]}")]
+        if digits.isdigit():
+            if len(digits) == 10:
+                return [("legal", "inn", digits)]
+            if len(digits) == 12:
+                return [("physical", "inn", digits), ("legal", "inn", digits)]
+            if len(digits) == 13:
+                return [("legal", "ogrn", digits)]
+            if len(digits) == 15:
+                return [("physical", "entrepreneurOgrnip", digits)]
+        if self.CASE_RE.match(q):
+            return [("legal", "caseNumber", q), ("physical", "caseNumber", q)]
+        return []
+
+    def lookup(self, query: str, kind: str = "", field: str = "", limit: int = 20) -> List[Tuple[str, Any]]:
+        """
+        -> [(kind, запись)]; kind/field сужают поиск ("" — определить по запросу)
+        """
+        kinds = [kind] if kind else list(RecordStore.TABLES)
+        if field:
+            plan = [(k, field, query.strip()) for k in kinds]
+        else:
+            plan = [p for p in self.detect(query) if p[0] in kinds]
+        out: List[Tuple[str, Any]] = []
+        if plan:
+            for k, f, value in plan:
+                out.extend((k, rec) for rec in self.store.find(k, f, value, limit - len(out)))
+                if len(out) >= limit:
+                    break
+            return out
+        for k in kinds:
+            out.extend((k, rec) for rec in self.store.search(k, query, limit))
+        return out[:limit]
+
+    @staticmethod
+    def to_dict(kind: str, rec: Any) -> Dict[str, Any]:
+        return {"kind": kind, **record_dict(rec)}
+
+    def serve(self, host: str, port: int) -> None:
+        """
+        HTTP JSON API: GET /lookup?q=...&kind=legal|physical&field=...&limit=20
+        """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from urllib.parse import parse_qs
+
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path, _, qs = self.path.partition("?")
+                if path != "/lookup":
+                    self.send_error(404)
+                    return
+                params = {k: vals[0] for k, vals in parse_qs(qs).items()}
+                kind = params.get("kind", "")
+                if not params.get("q") or kind not in ("", *RecordStore.TABLES):
+                    self.send_error(400, "нужен параметр q, kind — legal или physical")
+                    return
+                try:
+                    found = service.lookup(params["q"], kind, params.get("field", ""),
+                                           max(1, min(int(params.get("limit", 20)), 500)))
+                except ValueError as ex:
+                    self.send_error(400, str(ex))
+                    return
+                body = json.dumps([service.to_dict(k, rec) for k, rec in found], ensure_ascii=False).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        log.info("Поиск по хранилищу: http://%s:%d/lookup?q=...", host, port)
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+
+
+# =========================
+# MAIN (как FedresursParserApp)
+# =========================
+def build_arg_parser() -> argparse.ArgumentParser:
+    ap = argparse.ArgumentParser(description="Глубокий парсер банкротов fedresurs.ru")
+    ap.add_argument("--target", type=int, default=50, help="сколько записей собрать по каждому типу")
+    ap.add_argument("--page-size", type=int, default=15, help="размер страницы списка (начальный, см. --max-page-size)")
+    ap.add_argument("--max-page-size", type=int, default=100,
+                    help="до скольки элементов наращивать страницу списка, пока сервер отвечает быстро "
+                         "(0 — всегда --page-size)")
+    ap.add_argument("--workers", type=int, default=4, help="сколько карточек собирать одновременно")
+    ap.add_argument("--page-overlap", type=int, default=5,
+                    help="сколько элементов предыдущей страницы захватывать для выравнивания при сдвиге списка "
+                         "(0 — листать простым offset)")
+    ap.add_argument("--queue-size", type=int, default=0,
+                    help="ёмкость очереди между списками и воркерами (0 — 4 × workers)")
+    ap.add_argument("--batch-size", type=int, default=50, help="размер пачки записи в хранилище")
+    ap.add_argument("--bankrot-concurrency", type=int,
+                    default=ApiService.DEFAULT_HOST_LIMITS[ApiService.BANKROT_HOST],
+                    help="макс. одновременных запросов к bankrot.fedresurs.ru")
+    ap.add_argument("--fedresurs-concurrency", type=int,
+                    default=ApiService.DEFAULT_HOST_LIMITS[ApiService.FEDRESURS_HOST],
+                    help="макс. одновременных запросов к fedresurs.ru")
+    ap.add_argument("--bankrot-rps", type=float,
+                    default=ApiService.DEFAULT_HOST_RATES[ApiService.BANKROT_HOST],
+                    help="стартовая скорость запросов/сек к bankrot.fedresurs.ru")
+    ap.add_argument("--fedresurs-rps", type=float,
+                    default=ApiService.DEFAULT_HOST_RATES[ApiService.FEDRESURS_HOST],
+                    help="стартовая скорость запросов/сек к fedresurs.ru")
+    ap.add_argument("--biddings-parallel", type=int, default=4,
+                    help="сколько страниц торгов запрашивать параллельно, если нет счётчика found")
+    ap.add_argument("--bankrot-base", default=ApiService.BANKROT_BASE,
+                    help="база bankrot.fedresurs.ru (для прогонов на fedresurs_mock.py)")
+    ap.add_argument("--fedresurs-base", default=ApiService.FEDRESURS_BASE,
+                    help="база fedresurs.ru (для прогонов на fedresurs_mock.py)")
+    ap.add_argument("--enrich", choices=list(ApiService.ENRICHMENT_PROFILES), default="full",
+                    help="какие подзапросы карточки делать: list-only — только поля списка, "
+                         "core — + companies/persons, full — всё (ieb, publications, торги, ИП)")
+    ap.add_argument("--defer-enrichment", action="store_true",
+                    help="сначала сохранить лёгкие записи (core), остальное из --enrich дозаполнить позже")
+    ap.add_argument("--no-backfill", action="store_true",
+                    help="не разбирать очередь дозаполнения в этом запуске (см. команду backfill)")
+    ap.add_argument("--output", default="fedresurs_deep_parsed.xlsx", help="файл Excel")
+    ap.add_argument("--db", default="fedresurs.sqlite3", help="основное хранилище записей (SQLite)")
+    ap.add_argument("--no-db", action="store_true",
+                    help="без хранилища: дописывать записи прямо в Excel, как раньше")
+    ap.add_argument("--no-report", action="store_true", help="не перестраивать отчёт Excel после сбора")
+    ap.add_argument("--no-excel", action="store_true", help="не выгружать в Excel совсем (только хранилище / --stream)")
+    ap.add_argument("--stream", default="", metavar="PREFIX",
+                    help="писать каждую запись сразу по мере сбора в PREFIX-<legal|physical>-NNNN.<формат>")
+    ap.add_argument("--stream-format", choices=RecordSink.FORMATS, default="ndjson", help="формат --stream")
+    ap.add_argument("--stream-gzip", action="store_true", help="сжимать файлы --stream (gzip)")
+    ap.add_argument("--stream-rotate-mb", type=int, default=100,
+                    help="начинать новый файл --stream после стольких МБ (0 — без ротации)")
+    ap.add_argument("--report-only", action="store_true",
+                    help="ничего не собирать, только построить отчёт Excel из хранилища")
+    ap.add_argument("--incremental", action="store_true",
+                    help="не собирать карточки GUID, которые уже есть в файле Excel")
+    ap.add_argument("--stop-after-known", type=int, default=50,
+                    help="в режиме --incremental: прекратить листать список после стольких известных GUID подряд")
+    ap.add_argument("--journal", default="fedresurs_journal.jsonl",
+                    help="журнал собранных записей и смещений (для --resume)")
+    ap.add_argument("--resume", action="store_true",
+                    help="продолжить прерванный запуск по журналу")
+    ap.add_argument("--metrics-json", default="", help="периодически сохранять снимок метрик в этот JSON")
+    ap.add_argument("--metrics-interval", type=float, default=30.0, help="период снимков метрик, сек")
+    ap.add_argument("--metrics-port", type=int, default=0, help="отдавать /metrics (Prometheus) на этом порту")
+    ap.add_argument("--metrics-host", default="127.0.0.1",
+                    help="адрес для /metrics (0.0.0.0 — на всех интерфейсах)")
+    ap.add_argument("--cache-file", default="fedresurs_cache.sqlite3", help="дисковый кэш ответов карточек")
+    ap.add_argument("--no-cache", action="store_true", help="не использовать кэш ответов")
+    ap.add_argument("--cache-max-mb", type=int, default=512, help="предельный размер кэша, МБ")
+    ap.add_argument("--cache-ttl", action="append", default=[], metavar="ENDPOINT=SECONDS",
+                    help="переопределить TTL эндпоинта, напр. publications=3600 (0 — не кэшировать)")
+    ap.add_argument("--proxy", default="", help="HTTP(S)-прокси для всех запросов (свой выход в сеть у узла)")
+    ap.add_argument("--profile", action="store_true",
+                    help="профиль прогона: время и память по фазам, время потоков по категориям "
+                         "(сеть, ожидание, разбор, хранилище, выгрузка)")
+    ap.add_argument("--profile-dir", default="",
+                    help="с --profile: писать cProfile каждой фазы (<фаза>.pstats, с рабочими потоками) и profile.json сюда")
+    ap.add_argument("--profile-no-memory", action="store_true",
+                    help="с --profile: не мерить память (tracemalloc замедляет разбор и выгрузку)")
+    ap.add_argument("--transport", choices=list(TRANSPORTS), default="requests",
+                    help="HTTP-клиент: requests (HTTP/1.1 keep-alive) или httpx (нужен пакет httpx)")
+    ap.add_argument("--http2", action="store_true",
+                    help="HTTP/2 через httpx (pip install httpx[http2]); подразумевает --transport httpx")
+    ap.add_argument("--connect-timeout", type=float, default=5.0, help="таймаут установки соединения, сек")
+    ap.add_argument("--read-timeout", type=float, default=30.0,
+                    help="таймаут чтения ответа, сек (для списков — вдвое больше)")
+    ap.add_argument("--endpoint-timeout", action="append", default=[], metavar="ENDPOINT=SECONDS",
+                    help="свой таймаут чтения для эндпоинта, напр. biddings=60")
+    ap.add_argument("--breaker-threshold", type=int, default=5,
+                    help="после стольких неудачных попыток подряд подзапрос карточки временно не вызывается")
+    ap.add_argument("--breaker-cooldown", type=float, default=30.0,
+                    help="на сколько секунд отключать недоступный подзапрос (затем пробный запрос)")
+
+    # общие параметры задаются до имени команды: fedresurs_parser.py --workers 8 shard-work ...
+    sub = ap.add_subparsers(dest="command", metavar="COMMAND")
+
+    def shard_opts(p: argparse.ArgumentParser) -> None:
+        p.add_argument("--units", default="fedresurs_units.json", help="файл плана (единицы работы)")
+        p.add_argument("--shard-dir", default="fedresurs_shards", help="каталог шардов")
+
+    p = sub.add_parser("shard-plan", help="разбить списки на единицы работы")
+    shard_opts(p)
+    p.add_argument("--unit-size", type=int, default=1000, help="записей в единице работы")
+    p.add_argument("--shard-limit", type=int, default=0, help="сколько записей каждого типа брать (0 — все)")
+
+    p = sub.add_parser("shard-work", help="собрать свою долю единиц работы (на любом узле)")
+    shard_opts(p)
+    p.add_argument("--worker-index", type=int, default=0, help="номер узла, с 0")
+    p.add_argument("--worker-count", type=int, default=1, help="сколько всего узлов")
+
+    p = sub.add_parser("shard-merge", help="слить шарды в основное хранилище (--db)")
+    shard_opts(p)
+
+    p = sub.add_parser("backfill", help="дозаполнить отложенные поля записей в хранилище (--db)")
+    p.add_argument("--all", action="store_true",
+                   help="сначала поставить в очередь все записи хранилища (подзапросы профиля --enrich)")
+
+    p = sub.add_parser("refresh", help="пересобрать известные записи и обновить изменившиеся (по хэшу содержимого)")
+    p.add_argument("--active-only", action="store_true", help="только незавершённые дела")
+    p.add_argument("--changes-out", default="", help="сохранить изменения этого запуска в CSV")
+
+    p = sub.add_parser("schedule", help="демон: опрос новых банкротов и обновление известных в пределах бюджета")
+    p.add_argument("--active-interval", type=float, default=6.0, help="как часто проверять активные дела, часов")
+    p.add_argument("--completed-interval", type=float, default=168.0,
+                   help="как часто проверять завершённые дела, часов")
+    p.add_argument("--poll-interval", type=float, default=60.0, help="как часто опрашивать списки, минут")
+    p.add_argument("--poll-target", type=int, default=200, help="сколько новых записей каждого типа брать за опрос")
+    p.add_argument("--budget", type=float, default=2000.0, help="запросов в час на всё")
+    p.add_argument("--report-interval", type=float, default=60.0,
+                   help="как часто перестраивать отчёт Excel при изменениях, минут")
+    p.add_argument("--run-for", type=float, default=0.0, help="сколько минут работать (0 — пока не прервут)")
+
+    def lookup_opts(p: argparse.ArgumentParser) -> None:
+        p.add_argument("--reindex", action="store_true", help="перестроить полнотекстовый индекс перед поиском")
+
+    p = sub.add_parser("lookup", help="найти записи в хранилище (--db): ИНН, ОГРН, СНИЛС, номер дела или текст")
+    lookup_opts(p)
+    p.add_argument("query", help="что искать")
+    p.add_argument("--kind", choices=list(RecordStore.TABLES), default="", help="только ЮЛ или только ФЛ")
+    p.add_argument("--field", default="", help="точный поиск по этому полю вместо автоопределения")
+    p.add_argument("--limit", type=int, default=20)
+    p.add_argument("--json", action="store_true", help="вывести JSON вместо таблицы")
+
+    p = sub.add_parser("serve", help="HTTP JSON API поиска по хранилищу: GET /lookup?q=...")
+    lookup_opts(p)
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8080)
+
+    p = sub.add_parser("shard", help="план + локальные процессы + слияние")
+    shard_opts(p)
+    p.add_argument("--processes", type=int, default=4, help="сколько процессов-воркеров")
+    p.add_argument("--unit-size", type=int, default=1000, help="записей в единице работы")
+    p.add_argument("--shard-limit", type=int, default=0, help="сколько записей каждого типа брать (0 — все)")
+    return ap
+
+
+def build_profiler(args: argparse.Namespace) -> Optional[Profiler]:
+    if not args.profile:
+        return None
+    return Profiler(memory=not args.profile_no_memory, profile_dir=args.profile_dir)
+
+
+def profile_phase(profiler: Optional[Profiler], name: str):
+    return profiler.phase(name) if profiler is not None else nullcontext()
+
+
+def build_api(args: argparse.Namespace, profiler: Optional[Profiler] = None) -> ApiService:
+    cache = None
+    if not args.no_cache:
+        ttls = {}
+        for spec in args.cache_ttl:
+            name, _, seconds = spec.partition("=")
+            ttls[name.strip()] = float(seconds)
+        cache = ResponseCache(args.cache_file, ttls=ttls, max_bytes=args.cache_max_mb * 1024 * 1024)
+
+    endpoint_timeouts = {}
+    for spec in args.endpoint_timeout:
+        name, _, seconds = spec.partition("=")
+        endpoint_timeouts[name.strip()] = float(seconds)
+
+    return ApiService(
+        host_limits={
+            ApiService.BANKROT_HOST: args.bankrot_concurrency,
+            ApiService.FEDRESURS_HOST: args.fedresurs_concurrency,
+        },
+        host_rates={
+            ApiService.BANKROT_HOST: args.bankrot_rps,
+            ApiService.FEDRESURS_HOST: args.fedresurs_rps,
+        },
+        cache=cache,
+        biddings_parallel=args.biddings_parallel,
+        bankrot_base=args.bankrot_base,
+        fedresurs_base=args.fedresurs_base,
+        proxy=args.proxy or None,
+        breaker_threshold=args.breaker_threshold,
+        breaker_cooldown=args.breaker_cooldown,
+        max_page_size=args.max_page_size,
+        profiler=profiler,
+        transport="httpx" if args.http2 else args.transport,
+        http2=args.http2,
+        connect_timeout=args.connect_timeout,
+        read_timeout=args.read_timeout,
+        endpoint_timeouts=endpoint_timeouts,
+    )
+
+
+def build_sink(args: argparse.Namespace) -> Optional[RecordSink]:
+    if not args.stream:
+        return None
+    return RecordSink(args.stream, args.stream_format, args.stream_gzip, args.stream_rotate_mb * 1024 * 1024)
+
+
+def enrichment_plan(args: argparse.Namespace) -> Tuple[frozenset, frozenset]:
+    """
+    -> (подзапросы при сборе, отложенные подзапросы)
+    """
+    wanted = ApiService.ENRICHMENT_PROFILES[args.enrich]
+    if not args.defer_enrichment:
+        return wanted, frozenset()
+    core = ApiService.ENRICHMENT_PROFILES["core"]
+    return wanted & core, wanted - core
+
+
+def run_backfill_command(args: argparse.Namespace) -> None:
+    profiler = build_profiler(args)
+    api = build_api(args, profiler)
+    store = RecordStore(args.db)
+    try:
+        if args.all:
+            endpoints = ApiService.ENRICHMENT_PROFILES[args.enrich]
+            for kind in RecordStore.TABLES:
+                store.queue_backfill(kind, store.known_guids(kind), endpoints)
+        log.info("В очереди дозаполнения: %d записей", store.backfill_count())
+        with profile_phase(profiler, "backfill"):
+            filled = CrawlEngine(api, workers=args.workers, store=store, batch_size=args.batch_size).backfill()
+        log.info("Дозаполнено записей: %d", filled)
+        if not args.no_report:
+            with profile_phase(profiler, "export"), api._timed("export"):
+                ExcelExporter().refresh_report(store, args.output)
+    finally:
+        if profiler is not None:
+            profiler.report()
+        api.metrics.log_summary()
+        api.close()
+        store.close()
+
+
+def run_refresh_command(args: argparse.Namespace) -> None:
+    profiler = build_profiler(args)
+    api = build_api(args, profiler)
+    store = RecordStore(args.db)
+    started = time.time()
+    try:
+        engine = CrawlEngine(api, workers=args.workers, store=store, batch_size=args.batch_size,
+                             endpoints=ApiService.ENRICHMENT_PROFILES[args.enrich])
+        with profile_phase(profiler, "refresh"):
+            checked, changed = engine.refresh(active_only=args.active_only)
+        log.info("Обновление: проверено %d, изменилось %d", checked, changed)
+
+        changes = list(store.iter_changes(started))
+        for ts, kind, guid, fld, old, new in changes:
+            log.info("  %s %s: %s: %r -> %r", "ЮЛ" if kind == "legal" else "ФЛ", guid, fld, old, new)
+        if args.changes_out:
+            with open(args.changes_out, "w", encoding="utf-8-sig", newline="") as fh:
+                w = csv.writer(fh)
+                w.writerow(["ts", "kind", "guid", "field", "old", "new"])
+                for ts, *rest in changes:
+                    w.writerow([datetime.fromtimestamp(ts).isoformat(timespec="seconds"), *rest])
+
+        # отчёт перестраиваем, только если что-то поменялось
+        if changed and not args.no_report:
+            with profile_phase(profiler, "export"), api._timed("export"):
+                ExcelExporter().export_report(store, args.output)
+    finally:
+        if profiler is not None:
+            profiler.report()
+        api.metrics.log_summary()
+        api.close()
+        store.close()
+
+
+def run_schedule_command(args: argparse.Namespace) -> None:
+    api = build_api(args)
+    reporter = MetricsReporter(api.metrics, args.metrics_json, args.metrics_interval, args.metrics_port,
+                               args.metrics_host).start()
+    store = RecordStore(args.db)
+    endpoints, deferred = enrichment_plan(args)
+    sink = build_sink(args)
+    engine = CrawlEngine(api, workers=args.workers, store=store, queue_size=args.queue_size,
+                         batch_size=args.batch_size, endpoints=endpoints, defer=deferred,
+                         idle_backfill=not args.no_backfill, page_overlap=args.page_overlap, sink=sink)
+    exporter = ExcelExporter()
+    scheduler = RefreshScheduler(
+        engine, store,
+        active_interval=args.active_interval * 3600, completed_interval=args.completed_interval * 3600,
+        poll_interval=args.poll_interval * 60, budget_per_hour=args.budget,
+        poll_target=args.poll_target, page_size=args.page_size, stop_after_known=args.stop_after_known,
+        batch=args.batch_size,
+        report=None if args.no_report or args.no_excel else (lambda: exporter.export_report(store, args.output)),
+        report_interval=args.report_interval * 60,
+    )
+    try:
+        scheduler.run(args.run_for * 60)
+    except KeyboardInterrupt:
+        log.warning("Остановлено пользователем")
+    finally:
+        if sink is not None:
+            sink.close()
+        reporter.stop()
+        api.metrics.log_summary()
+        api.close()
+        store.close()
+
+
+def run_lookup_command(args: argparse.Namespace) -> None:
+    store = RecordStore(args.db)
+    try:
+        if args.reindex:
+            store.rebuild_search_index()
+        if not store.fts:
+            log.warning("В этой сборке SQLite нет FTS5 — работает только поиск по реквизитам")
+        service = LookupService(store)
+        if args.command == "serve":
+            try:
+                service.serve(args.host, args.port)
+            except KeyboardInterrupt:
+                log.warning("Остановлено пользователем")
+            return
+        try:
+            found = service.lookup(args.query, args.kind, args.field, args.limit)
+        except ValueError as ex:
+            log.error("%s", ex)
+            return
+        if args.json:
+            print(json.dumps([service.to_dict(k, rec) for k, rec in found], ensure_ascii=False, indent=2))
+            return
+        for kind, rec in found:
+            status = rec.caseStatus if kind == "legal" else rec.bankruptcyStatus
+            print("\t".join(["ЮЛ" if kind == "legal" else "ФЛ", rec.inn, rec.fullName, rec.caseNumber,
+                             status, rec.sourceUrl]))
+        log.info("Найдено: %d", len(found))
+    finally:
+        store.close()
+
+
+def main(argv: Optional[List[str]] = None):
+    ap = build_arg_parser()
+    args = ap.parse_args(argv)
+    if args.report_only and args.no_db:
+        ap.error("--report-only строит отчёт из хранилища и несовместим с --no-db")
+    if args.defer_enrichment and args.no_db:
+        ap.error("--defer-enrichment хранит очередь дозаполнения в хранилище и несовместим с --no-db")
+    if (args.transport == "httpx" or args.http2) and httpx is None:
+        ap.error("--transport httpx / --http2 требуют пакет httpx: pip install httpx[http2]")
+    if args.no_db and args.no_excel and not args.stream:
+        ap.error("с --no-db и --no-excel собранное некуда сохранять — укажите --stream")
+    if args.command == "backfill":
+        run_backfill_command(args)
+        return
+    if args.command == "refresh":
+        run_refresh_command(args)
+        return
+    if args.command in ("lookup", "serve"):
+        if args.no_db:
+            ap.error(f"{args.command} ищет в хранилище и несовместим с --no-db")
+        run_lookup_command(args)
+        return
+    if args.command == "schedule":
+        if args.no_db:
+            ap.error("schedule работает с хранилищем и несовместим с --no-db")
+        run_schedule_command(args)
+        return
+    if args.command:
+        run_shard_command(args)
+        return
+
+    exporter = ExcelExporter()
+    file_name = args.output
+
+    store = None
+    if not args.no_db:
+        store = RecordStore(args.db)
+        if store.count("legal") + store.count("physical") == 0 and os.path.exists(file_name):
+            # первый запуск с хранилищем: переносим то, что уже собрано в Excel
+            moved = {"legal": [], "physical": []}
+            for kind, rec in exporter.iter_workbook_records(file_name):
+                moved[kind].append(rec)
+            log.info("Перенос из %s в хранилище %s: ЮЛ=%d, ФЛ=%d", file_name, args.db,
+                     store.upsert("legal", moved["legal"]), store.upsert("physical", moved["physical"]))
+
+    if args.report_only:
+        try:
+            exporter.export_report(store, file_name)
+        finally:
+            store.close()
+        return
+
+    log.info("====================================================")
+    log.info("ЗАПУСК ПРОФЕССИОНАЛЬНОГО ПАРСЕРА (ГЛУБОКИЙ СБОР)")
+    log.info("====================================================")
+
+    profiler = build_profiler(args)
+    api = build_api(args, profiler)
+    reporter = MetricsReporter(api.metrics, args.metrics_json, args.metrics_interval, args.metrics_port,
+                               args.metrics_host).start()
+    journal = CrawlJournal(args.journal)
+    # записи в памяти нужны только для дозаписи в Excel без хранилища; иначе из журнала берутся
+    # только GUID и смещения, а сами записи переносятся в хранилище потоком (engine.replay)
+    keep_results = store is None and not args.no_excel
+    resumed = {"legal": [], "physical": []}
+    resumed_guids, offsets = {"legal": set(), "physical": set()}, {}
+    if args.resume:
+        if keep_results:
+            resumed, offsets = journal.load()
+        else:
+            resumed_guids, offsets = journal.scan()
+        log.info("Продолжаем по журналу %s: уже собрано ЮЛ=%d (offset=%d), ФЛ=%d (offset=%d)",
+                 args.journal, len(resumed["legal"]) + len(resumed_guids["legal"]), offsets["legal"],
+                 len(resumed["physical"]) + len(resumed_guids["physical"]), offsets["physical"])
+    journal.open(resume=args.resume)
+
+    endpoints, deferred = enrichment_plan(args)
+    if args.enrich != "full" or deferred:
+        log.info("Профиль обогащения: %s%s", args.enrich,
+                 f", отложено: {', '.join(sorted(deferred))}" if deferred else "")
+    sink = build_sink(args)
+    engine = CrawlEngine(api, workers=args.workers, journal=journal, store=store,
+                         queue_size=args.queue_size, batch_size=args.batch_size,
+                         endpoints=endpoints, defer=deferred, idle_backfill=not args.no_backfill,
+                         page_overlap=args.page_overlap, sink=sink, keep_results=keep_results)
+    exported = False
+
+    try:
+        # записи журнала — с теми же правилами, что при сборе: пустые поля не затирают сохранённые
+        engine.replay(journal.replay() if args.resume else ())
+
+        known_legal, known_phys = set(), set()
+        stop_after_known = 0
+        if args.incremental:
+            if store is not None:
+                known_legal, known_phys = store.known_guids("legal"), store.known_guids("physical")
+            else:
+                known_legal, known_phys = exporter.read_known_guids(file_name)
+            stop_after_known = args.stop_after_known
+            log.info("Инкрементальный режим: известно ЮЛ=%d, ФЛ=%d", len(known_legal), len(known_phys))
+
+        log.info(">>> Сбор Юридических и Физических лиц через GUID карточки (параллельно)...")
+        with profile_phase(profiler, "crawl"):
+            collected = engine.run([
+                CrawlTask(True, args.target, args.page_size, known_legal, stop_after_known,
+                          offsets.get("legal", 0), resumed["legal"], done_guids=resumed_guids["legal"]),
+                CrawlTask(False, args.target, args.page_size, known_phys, stop_after_known,
+                          offsets.get("physical", 0), resumed["physical"], done_guids=resumed_guids["physical"]),
+            ])
+        legals: List[LegalEntity] = collected["legal"]
+        physicals: List[PhysicalPerson] = collected["physical"]
+
+        if store is not None and not args.no_backfill and store.backfill_count():
+            log.info(">>> Дозаполнение отложенных полей: в очереди %d записей", store.backfill_count())
+            with profile_phase(profiler, "backfill"):
+                log.info("Дозаполнено записей: %d", engine.backfill())
+
+        with profile_phase(profiler, "export"), api._timed("export"):
+            if args.no_excel:
+                pass
+            elif store is None:
+                log.info(">>> Сохранение данных в Excel: %s", file_name)
+                exporter.export_resume(legals, physicals, file_name)
+            elif not args.no_report:
+                log.info(">>> Построение отчёта Excel из хранилища: %s", file_name)
+                exporter.refresh_report(store, file_name)
+        exported = True
+
+        log.info("ГОТОВО! Данные сохранены.")
+
+    except KeyboardInterrupt:
+        log.warning("Остановлено пользователем")
+    except Exception as e:
+        log.exception("Критическая ошибка: %s", e)
+    finally:
+        if sink is not None:
+            sink.close()
+            log.info("Потоковая выгрузка: ЮЛ=%d, ФЛ=%d", sink.written["legal"], sink.written["physical"])
+        if exported:
+            journal.clear()
+        else:
+            journal.close()
+            log.warning("Собранное сохранено в журнале %s — продолжить можно с --resume", args.journal)
+        if api.cache is not None:
+            log.info("Кэш ответов: %s", api.cache.stats())
+        if profiler is not None:
+            profiler.report()
+        reporter.stop()
+        api.metrics.log_summary()
+        api.close()
+        if store is not None:
+            store.close()
 
 
 if __name__ == "__main__":